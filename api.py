@@ -0,0 +1,47 @@
+# Imports
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#----------------------------------------------------------------------------#
+# JSON API serialization.
+#
+# The /api/v1 routes serialize rows straight from the query layer: no ORM
+# objects, no templates. orjson is used when it is installed (it encodes
+# datetimes itself); otherwise the stdlib encoder with compact separators.
+#----------------------------------------------------------------------------#
+
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def dumps(data):
+    # data -> JSON bytes
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def row_dicts(rows, fields):
+    # query rows -> dicts, with the comma-joined genres column as a list
+    split = 'genres' in fields
+    results = []
+    for row in rows:
+        item = dict(zip(fields, row))
+        if split:
+            item['genres'] = item['genres'].split(',') if item['genres'] else []
+        results.append(item)
+    return results
+
+
+def project(data, fields):
+    # keep only the requested top-level keys of a detail document
+    if not fields:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
@@ -3,20 +3,41 @@
 #----------------------------------------------------------------------------#
 
 import json
-import babel
+import hashlib
 import logging
 import dateutil.parser
-from datetime import datetime
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
+from datetime import datetime, timedelta
+from functools import wraps
+from itertools import groupby
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort, stream_with_context, session, make_response
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import desc
+from sqlalchemy.exc import IntegrityError
 from flask_migrate import Migrate # Imported Migrate from flask_migrate.
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import is_resource_modified
 import sys
+import threading
+import time
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
-from models import db, Venue, Artist, Show
+from models import db, Venue, Artist, Show, Genre, venue_genres, artist_genres, set_genres, table_versions, bump_versions, count_shows, roll_over_shows, DEFAULT_SHOW_DURATION
+from search import get_backend
+from suggest import PrefixIndex
+from cache import make_cache
+from importer import Importer, read_rows
+from exporter import EXPORTS, FORMATS, iter_export
+from queries import MODELS, catalog_query, parse_fields
+from schedule import free_slots, busy_times, venues_availability, weekly, book_shows, is_overlap_violation
+import api
+from dates import format_datetime, format_datetimes
+from engine import engine_options, pool_status
+from routing import read_replica, choose_bind, stick_to_primary, reading_own_writes
+from metrics import metrics, pool_metrics, start_request, finish_request
+from profiler import start_profile, finish_profile
+import slowlog
+import click
 import config
 import collections
 collections.Callable = collections.abc.Callable
@@ -27,32 +48,191 @@ collections.Callable = collections.abc.Callable
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+app.config.from_envvar('FYYUR_SETTINGS', silent=True)
+
+# TODO: connect to a local postgresql database
+# DONE: the database URL and pool settings come from config.py (environment)
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
 db.init_app(app) # changed from db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
-# TODO: connect to a local postgresql database
-app.config['SQLALCHEMY_DATABASE_URI'] = config.SQLALCHEMY_DATABASE_URI
-# DONE: I connected to local postgres db in config.py
+# read-only views query a replica when DATABASE_REPLICA_URLS is set (routing.py)
+app.before_request(choose_bind)
+app.after_request(stick_to_primary)
+
+# per-route latency and SQL statements per request, served at /metrics
+app.before_request(start_request)
+app.after_request(finish_request)
+
+# opt-in profiling of single requests when PROFILING is on (profiler.py)
+app.before_request(start_profile)
+app.after_request(finish_profile)
+
+# statements slower than SLOW_QUERY_MS are logged with their plans (slowlog.py)
+if app.config['SLOW_QUERY_MS']:
+	slowlog.log_to(app.config['SLOW_QUERY_LOG'])
 
 
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
-def format_datetime(value, format='medium'):
-	if isinstance(value, str):
-		date = dateutil.parser.parse(value)
-	else:
-		date = value
-	
-	if format == 'full':
-		format="EEEE MMMM, d, y 'at' h:mma"
-	elif format == 'medium':
-		format="EE MM, dd, y h:mma"
-	return babel.dates.format_datetime(date, format, locale='en')
-
+# formats show times (see dates.py); pages with many shows pass the view
+# pre-formatted times from format_datetimes() instead
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+def page_limit():
+	# read ?limit= and clamp it to [1, MAX_PAGE_SIZE]
+	limit = request.args.get('limit', app.config['PAGE_SIZE'], type=int)
+	return max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+def search_backend():
+	# resolved on first use, once the engine (and so the dialect) is known
+	if 'search' not in app.extensions:
+		app.extensions['search'] = get_backend(db, app.config['SEARCH_BACKEND'])
+	return app.extensions['search']
+
+@app.cli.command('search-index')
+def search_index():
+	"""Create (or rebuild) the indexes used by venue and artist search."""
+	search_backend().install()
+	print('Search indexes installed for the {} backend.'.format(search_backend().name))
+
+# in-process autocomplete index over artist and venue names (see suggest.py)
+suggest_index = PrefixIndex()
+
+# held by whichever thread is (re)loading suggest_index
+suggest_loading = threading.Lock()
+
+def load_suggestions():
+	# read every artist and venue name into the index; the caller holds suggest_loading
+	suggest_index.start_reload()
+	rows = [('venue', id, name) for id, name in db.session.query(Venue.id, Venue.name)]
+	rows += [('artist', id, name) for id, name in db.session.query(Artist.id, Artist.name)]
+	suggest_index.load(rows)
+
+def refresh_suggestions():
+	# background reload, which also picks up writes made by other worker processes
+	try:
+		with app.app_context():
+			load_suggestions()
+	except Exception:
+		app.logger.exception('reloading the suggestion index failed')
+	finally:
+		suggest_loading.release()
+
+def suggestions():
+	# the index, loaded on first use. Every SUGGEST_REFRESH_SECONDS one request
+	# starts a reload in the background; requests keep using the current index
+	loaded_at = suggest_index.loaded_at
+	if loaded_at is None:
+		with suggest_loading:
+			if suggest_index.loaded_at is None:
+				load_suggestions()
+	elif time.monotonic() - loaded_at > app.config['SUGGEST_REFRESH_SECONDS'] and suggest_loading.acquire(blocking=False):
+		threading.Thread(target=refresh_suggestions, daemon=True).start()
+	return suggest_index
+
+def stream_template(template_name, **context):
+	# render a template chunk by chunk so the first bytes go out
+	# while the rows in the context are still being fetched
+	app.update_template_context(context)
+	template = app.jinja_env.get_template(template_name)
+	return Response(stream_with_context(template.generate(context)))
+
+#----------------------------------------------------------------------------#
+# Caching.
+#----------------------------------------------------------------------------#
+# read-through cache for the venue and artist detail page data (see cache.py)
+page_cache = make_cache(app.config)
+
+def venue_cache_keys(venue_id):
+	# the venue's page, plus every artist page that lists a show there
+	artistIds = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+	return ['venue:{}'.format(venue_id)] + ['artist:{}'.format(id) for (id,) in artistIds]
+
+def artist_cache_keys(artist_id):
+	# the artist's page, plus every venue page that lists one of their shows
+	venueIds = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()
+	return ['artist:{}'.format(artist_id)] + ['venue:{}'.format(id) for (id,) in venueIds]
+
+def cached_page_data(key, build):
+	# right after a write the client reads from the primary (routing.py); the
+	# cache may hold a copy rebuilt from a lagging replica meanwhile, so skip it
+	if reading_own_writes():
+		return build()
+	return page_cache.get_or_set(key, build)
+
+def split_shows(shows):
+	# shows are sorted by start_time; split them at "now" on every request
+	# so cached page data never goes stale as shows move into the past
+	now = datetime.now()
+	upcoming_shows = [show for show in shows if show['start_time'] >= now]
+	past_shows = [show for show in shows if show['start_time'] < now]
+	return upcoming_shows, past_shows
+
+@app.route('/cache/stats')
+def cache_stats():
+	return jsonify(page_cache.stats())
+
+@app.route('/pool/stats')
+def pool_stats():
+	# connection pool use and checkout waits for this worker
+	return jsonify(pool_status(db.engine))
+
+@app.route('/metrics')
+def prometheus_metrics():
+	# Prometheus text format; the numbers are for this worker process
+	return Response(metrics.render(pool_metrics(db.engine)), mimetype='text/plain; version=0.0.4')
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+def page_validators(full_path, tables, versions, time_sensitive=False):
+	# (ETag, Last-Modified) of the page at full_path, from the table_versions()
+	# of the tables it shows; asgi.py answers its pages with the same ones
+	lastModified = max([updated for version, updated in versions.values()] or [datetime(1970, 1, 1)])
+	tag = [full_path] + ['{}:{}'.format(name, versions.get(name, (0, None))[0]) for name in tables]
+	if time_sensitive:
+		window = app.config['CONDITIONAL_GET_WINDOW']
+		bucket = int(time.time()) // window * window
+		tag.append(str(bucket))
+		lastModified = max(lastModified, datetime.utcfromtimestamp(bucket))
+	return hashlib.sha1('|'.join(tag).encode()).hexdigest(), lastModified.replace(microsecond=0)
+
+def conditional(*tables, time_sensitive=False):
+	# ETag/Last-Modified for a read page, derived from the version rows of the
+	# tables it shows. If-None-Match/If-Modified-Since are answered with a 304
+	# before the view runs, so a revalidation costs one primary-key query.
+	# time_sensitive pages (past/upcoming splits) also change as time passes,
+	# so their validators roll over every CONDITIONAL_GET_WINDOW seconds.
+	def decorator(view):
+		@wraps(view)
+		def wrapper(*args, **kwargs):
+			# a pending flash message has to be rendered, never 304'd away
+			if session.get('_flashes'):
+				return view(*args, **kwargs)
+			
+			etag, lastModified = page_validators(request.full_path, tables, table_versions(tables), time_sensitive)
+			if not is_resource_modified(request.environ, etag=etag, last_modified=lastModified):
+				response = Response(status=304)
+			else:
+				response = make_response(view(*args, **kwargs))
+				if response.status_code != 200:
+					return response
+			response.set_etag(etag)
+			response.last_modified = lastModified
+			response.cache_control.no_cache = True
+			return response
+		return wrapper
+	return decorator
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -62,41 +242,70 @@ def index():
 	return render_template('pages/home.html')
 
 
+@app.route('/search/suggest')
+@read_replica
+def search_suggest():
+	# typeahead for artists and venues, answered from memory.
+	# ?q= is the prefix, ?type=artist|venue narrows it, ?limit= caps it.
+	search_term = request.args.get('q', '')
+	kind = request.args.get('type')
+	limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+	
+	return jsonify({
+		'query': search_term,
+		'suggestions': suggestions().suggest(search_term, limit, kind)
+	})
+
+
 #  ----------------------------------------------------------------
 #  Venues
 #  ----------------------------------------------------------------
 @app.route('/venues')
+@read_replica
+@conditional('venues')
 def venues():
 	# TODO: replace with real venues data.
 	#       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
 
-	# Query venues from db
-	queriedVenues = Venue.query.order_by(Venue.state, Venue.city).all()
-	data = []
+	# one query: every venue with its write-maintained upcoming show count
+	queriedVenues = db.session.query(
+		Venue.id,
+		Venue.name,
+		Venue.city,
+		Venue.state,
+		Venue.upcoming_shows_count.label('num_upcoming_shows')
+	)
+	
+	# ?genre= narrows the list through the indexed genre tables
+	genre = request.args.get('genre')
+	if genre:
+		queriedVenues = queriedVenues.join(
+			venue_genres, venue_genres.c.venue_id == Venue.id
+		).join(
+			Genre, Genre.id == venue_genres.c.genre_id
+		).filter(Genre.name == genre)
 	
-	# for each venue in the queried venues
-	for eachVenue in queriedVenues:
-		venues = Venue.query.filter_by(city=eachVenue.city, state=eachVenue.state).all()
-		formatted_venues = []
-		for venue in venues:
-			show_count = Show.query.join(Venue).filter(Show.venue_id==venue.id).filter(Show.start_time>datetime.now()).count()
-			formatted_venues.append({
+	queriedVenues = queriedVenues.order_by(
+		Venue.state, Venue.city, Venue.id
+	).all()
+	
+	# rows are sorted by state and city, so each area is a contiguous run
+	data = []
+	for (state, city), areaVenues in groupby(queriedVenues, key=lambda venue: (venue.state, venue.city)):
+		data.append({
+			"city": city,
+			"state": state,
+			"venues": [{
 				"id": venue.id,
 				"name": venue.name,
-				"num_upcoming_shows": show_count
-			})
-			
-		
-		getCityState = {
-			"city": eachVenue.city,
-			"state": eachVenue.state,
-			"venues": formatted_venues
-		}
-		data.append(getCityState)
+				"num_upcoming_shows": venue.num_upcoming_shows
+			} for venue in areaVenues]
+		})
 		
-	return render_template('pages/venues.html', areas=data)
+	return render_template('pages/venues.html', areas=data, genre=genre)
 
 @app.route('/venues/search', methods=['POST'])
+@read_replica
 def search_venues():
 	# TODO: implement search on venues with partial string search. Ensure it is case-insensitive.
 	# search for Hop should return "The Musical Hop".
@@ -105,14 +314,8 @@ def search_venues():
 	# get search keyword from the form
 	search_term = request.form.get('search_term', '')
 	
-	# using 'ilike' in sqlalchemy.
-	# Reference link below: 
-	# http://docs.sqlalchemy.org/en/latest/orm/internals.html?highlight=ilike#sqlalchemy.orm.attributes.QueryableAttribute.ilike
-
-	# Query All venues That Have The Search Keyword In Their Name
-	found_venues = Venue.query.filter(
-		Venue.name.ilike('%{}%'.format(search_term))
-	).all()
+	# ranked, index-backed search over name, city, state and genres (see search.py)
+	found_venues = search_backend().search('venues', search_term, app.config['SEARCH_RESULTS_LIMIT'])
 	
 	data = []
 	# for each venue in the queried venues, get the id, name, and number of shows
@@ -131,49 +334,71 @@ def search_venues():
 	return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/venues/<int:venue_id>')
+@read_replica
+@conditional('venues', 'artists', 'Show', time_sensitive=True)
 def show_venue(venue_id):
 	# shows the venue page with the given venue_id
 	# TODO: replace with real venue data from the venues table, using venue_id
 
-	# query venue by venue_id
-	venue = Venue.query.get(venue_id)
+	venue = cached_page_data('venue:{}'.format(venue_id), lambda: venue_page_data(venue_id))
 	
 	# if the queried result is empty render a 404 page
 	if not venue:
 		return render_template('errors/404.html')
 	
-	shows = venue.shows # shows associated with the queried venue
-	upcoming_shows = []
-	past_shows = []
-	
-	# for each of the show in shows, get the artist name, image link and start time
-	for show in shows:
-		getArtistInfo = Show.query.join(Artist).with_entities(
-			Show.artist_id,
-			Artist.name,
-			Artist.image_link,
-			Show.start_time
-		).filter(Show.venue_id==venue_id).first()
-		
-		artistInfo ={
-            "artist_id": getArtistInfo[0],
-            "artist_name": getArtistInfo[1],
-            "artist_image_link": getArtistInfo[2],
-            "start_time": getArtistInfo[3]
-        }
-		
-		if show.start_time >= datetime.now():
-			upcoming_shows.append(artistInfo)
-		else:
-			past_shows.append(artistInfo)
+	upcoming_shows, past_shows = split_shows(venue['shows'])
+	venue = dict(
+		venue,
+		upcoming_shows=upcoming_shows,
+		upcoming_shows_count=len(upcoming_shows),
+		past_shows=past_shows,
+		past_shows_count=len(past_shows)
+	)
 	
-	venue.upcoming_shows = upcoming_shows
-	venue.upcoming_shows_count = len(upcoming_shows)
-	venue.past_shows = past_shows
-	venue.past_shows_count = len(past_shows)
+	return render_template('pages/show_venue.html', venue=venue)
+
+def venue_page_data(venue_id):
+	# everything the venue page shows, as plain data that can be cached
 	
+	# query venue by venue_id
+	venue = Venue.query.get(venue_id)
+	if not venue:
+		return None
 	
-	return render_template('pages/show_venue.html', venue=venue)
+	# every show at this venue with its artist's name and image in one joined query
+	shows = db.session.query(
+		Show.artist_id,
+		Artist.name,
+		Artist.image_link,
+		Show.start_time
+	).join(
+		Artist, Show.artist_id == Artist.id
+	).filter(
+		Show.venue_id == venue_id
+	).order_by(
+		Show.start_time
+	).all()
+	
+	return {
+		"id": venue.id,
+		"name": venue.name,
+		"genres": venue.genres.split(",") if venue.genres else [],
+		"address": venue.address,
+		"city": venue.city,
+		"state": venue.state,
+		"phone": venue.phone,
+		"website": venue.website_link,
+		"facebook_link": venue.facebook_link,
+		"seeking_talent": venue.looking_for_talent,
+		"seeking_description": venue.description,
+		"image_link": venue.image_link,
+		"shows": [{
+			"artist_id": show.artist_id,
+			"artist_name": show.name,
+			"artist_image_link": show.image_link,
+			"start_time": show.start_time
+		} for show in shows]
+	}
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -196,16 +421,18 @@ def create_venue_submission():
 			state = form.state.data
 			address = form.address.data
 			phone = form.phone.data
-			genres = ",".join(form.genres.data)
+			genres = form.genres.data
 			facebook_link = form.facebook_link.data
 			image_link = form.image_link.data
 			website_link = form.website_link.data
 			seeking_talent = form.seeking_talent.data
 			description = form.seeking_description.data
 
-			aVenue = Venue(name=name, city=city, state=state, address=address, phone=phone, genres=genres, facebook_link=facebook_link, image_link=image_link, website_link=website_link, looking_for_talent=seeking_talent, description=description)
+			aVenue = Venue(name=name, city=city, state=state, address=address, phone=phone, facebook_link=facebook_link, image_link=image_link, website_link=website_link, looking_for_talent=seeking_talent, description=description)
+			set_genres(aVenue, genres)
 			db.session.add(aVenue)
 			db.session.commit()
+			suggest_index.add('venue', aVenue.id, name)
 		except:
 			error = True
 			db.session.rollback()
@@ -232,8 +459,20 @@ def delete_venue(venue_id):
 	error = False
 	try:
 		venue = Venue.query.get(venue_id)
+		cacheKeys = venue_cache_keys(venue.id)
+		
+		# the venue's shows go with it; take them off their artists' counters
+		shows = db.session.query(Show.venue_id, Show.artist_id, Show.counted_as_past).filter(Show.venue_id == venue.id).all()
+		count_shows(shows, -1)
+		Show.query.filter(Show.venue_id == venue.id).delete(synchronize_session=False)
+		if shows:
+			# a bulk delete skips before_flush, so bump the Show version here
+			bump_versions(db.session.connection(), [Show.__tablename__])
+		
 		db.session.delete(venue)
 		db.session.commit()
+		suggest_index.remove('venue', int(venue_id))
+		page_cache.delete(*cacheKeys)
 	except:
 		error = True
 		db.session.rollback()
@@ -254,12 +493,62 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@read_replica
+@conditional('artists')
 def artists():
 	# TODO: replace with real data returned from querying the database
-	artists = db.session.query(Artist.id, Artist.name).order_by(desc('id')).all()
-	return render_template('pages/artists.html', artists=artists)
+
+	# ?sort=recent (default) lists newest artists first, ?sort=name alphabetically.
+	# both orderings are keyset paginated on ?after=<artist id>.
+	sort = request.args.get('sort', 'recent')
+	if sort not in ('recent', 'name'):
+		sort = 'recent'
+	
+	query = db.session.query(Artist.id, Artist.name)
+	
+	# ?genre= narrows the list through the indexed genre tables
+	genre = request.args.get('genre')
+	if genre:
+		query = query.join(
+			artist_genres, artist_genres.c.artist_id == Artist.id
+		).join(
+			Genre, Genre.id == artist_genres.c.genre_id
+		).filter(Genre.name == genre)
+	
+	if sort == 'name':
+		query = query.order_by(Artist.name, Artist.id)
+	else:
+		query = query.order_by(Artist.id.desc())
+	
+	# ?stream=1 renders the whole directory row by row from a server-side cursor
+	if request.args.get('stream', type=int):
+		artists = query.yield_per(app.config['PAGE_SIZE'])
+		return stream_template('pages/artists.html', artists=artists, sort=sort, genre=genre)
+	
+	after = request.args.get('after', type=int)
+	limit = page_limit()
+	if after is not None:
+		if sort == 'name':
+			# seek past (name, id) of the cursor artist
+			afterName = db.session.query(Artist.name).filter(Artist.id == after).scalar_subquery()
+			query = query.filter(db.or_(
+				Artist.name > afterName,
+				db.and_(Artist.name == afterName, Artist.id > after)
+			))
+		else:
+			query = query.filter(Artist.id < after)
+	
+	# fetch one extra row to know whether there is a next page
+	artists = query.limit(limit + 1).all()
+	next_after = None
+	if len(artists) > limit:
+		artists = artists[:limit]
+		next_after = artists[-1].id
+	
+	return render_template('pages/artists.html', artists=artists, sort=sort, genre=genre, after=after, next_after=next_after, limit=limit)
 
 @app.route('/artists/search', methods=['POST'])
+@read_replica
 def search_artists():
 	# TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
 	# search for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
@@ -268,14 +557,8 @@ def search_artists():
 	# get search keyword from the form
 	search_term = request.form.get('search_term', '')
 	
-	# using 'ilike' in sqlalchemy.
-	# Reference link below: 
-	# http://docs.sqlalchemy.org/en/latest/orm/internals.html?highlight=ilike#sqlalchemy.orm.attributes.QueryableAttribute.ilike
-	
-	# Query All artists That Have The Search Keyword In Their Name
-	found_artists = Artist.query.filter(
-		Artist.name.ilike('%{}%'.format(search_term))
-	).all()
+	# ranked, index-backed search over name, city, state and genres (see search.py)
+	found_artists = search_backend().search('artists', search_term, app.config['SEARCH_RESULTS_LIMIT'])
 
 	data = []
 	# for each artist in the queried artists, get the id, name, and number of shows
@@ -294,49 +577,71 @@ def search_artists():
 	return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/artists/<int:artist_id>')
+@read_replica
+@conditional('venues', 'artists', 'Show', time_sensitive=True)
 def show_artist(artist_id):
 	# shows the artist page with the given artist_id
 	# TODO: replace with real artist data from the artist table, using artist_id
 	
-	# query artist by artist_id
-	artist = Artist.query.get(artist_id)
+	artist = cached_page_data('artist:{}'.format(artist_id), lambda: artist_page_data(artist_id))
 	
 	# if the queried result is empty render a 404 page
 	if not artist:
 		return render_template('errors/404.html')
 	
-	shows = artist.shows # shows associated with the queried artist
-	upcoming_shows = []
-	past_shows = []
-	
-	# for each of the show in shows, get the venue name, image link and start time
-	for show in shows:
-		getVenueInfo = Show.query.join(Venue).with_entities(
-            Show.venue_id,
-            Venue.name,
-            Venue.image_link,
-            Show.start_time
-		).filter(Show.artist_id==artist_id).first()
-
-		venueInfo ={
-			"venue_id": getVenueInfo[0],
-			"venue_name": getVenueInfo[1],
-			"venue_image_link": getVenueInfo[2],
-			"start_time": format_datetime(str(getVenueInfo[3])), 
-        }
-		
-		if show.start_time >= datetime.now():
-			upcoming_shows.append(venueInfo)
-		else:
-			past_shows.append(venueInfo)
-	
-	artist.upcoming_shows = upcoming_shows
-	artist.upcoming_shows_count = len(upcoming_shows)
-	artist.past_shows = past_shows
-	artist.past_shows_count = len(past_shows)
+	upcoming_shows, past_shows = split_shows(artist['shows'])
+	artist = dict(
+		artist,
+		upcoming_shows=upcoming_shows,
+		upcoming_shows_count=len(upcoming_shows),
+		past_shows=past_shows,
+		past_shows_count=len(past_shows)
+	)
 
 	return render_template('pages/show_artist.html', artist=artist)
 
+def artist_page_data(artist_id):
+	# everything the artist page shows, as plain data that can be cached
+	
+	# query artist by artist_id
+	artist = Artist.query.get(artist_id)
+	if not artist:
+		return None
+	
+	# every show by this artist with its venue's name and image in one joined query
+	shows = db.session.query(
+		Show.venue_id,
+		Venue.name,
+		Venue.image_link,
+		Show.start_time
+	).join(
+		Venue, Show.venue_id == Venue.id
+	).filter(
+		Show.artist_id == artist_id
+	).order_by(
+		Show.start_time
+	).all()
+	
+	return {
+		"id": artist.id,
+		"name": artist.name,
+		"genres": artist.genres.split(",") if artist.genres else [],
+		"city": artist.city,
+		"state": artist.state,
+		"phone": artist.phone,
+		"website": artist.website_link,
+		"facebook_link": artist.facebook_link,
+		"seeking_venue": artist.looking_for_venues,
+		"seeking_description": artist.description,
+		"image_link": artist.image_link,
+		"shows": [{
+			"venue_id": show.venue_id,
+			"venue_name": show.name,
+			"venue_image_link": show.image_link,
+			"start_time": show.start_time
+		} for show in shows]
+	}
+
 #  ----------------------------------------------------------------
 #  Update
 #  ----------------------------------------------------------------
@@ -349,7 +654,7 @@ def edit_artist(artist_id):
 	form.city.data = artist.city
 	form.state.data = artist.state
 	form.phone.data = artist.phone
-	form.genres.data = artist.genres
+	form.genres.data = [genre.name for genre in artist.genre_list]
 	form.facebook_link.data = artist.facebook_link
 	form.image_link.data = artist.image_link
 	form.website_link.data = artist.website_link
@@ -364,6 +669,7 @@ def edit_artist_submission(artist_id):
 	# TODO: take values from the form submitted, and update existing
 	# artist record with ID <artist_id> using the new attributes
 	error = False
+	form = ArtistForm(request.form)
 
 	if form.validate():
 		try:
@@ -385,7 +691,7 @@ def edit_artist_submission(artist_id):
 			updateArtist.city = city
 			updateArtist.state = state
 			updateArtist.phone = phone
-			updateArtist.genres = genres
+			set_genres(updateArtist, genres)
 			updateArtist.facebook_link = facebook_link
 			updateArtist.image_link = image_link
 			updateArtist.website_link = website_link
@@ -393,6 +699,8 @@ def edit_artist_submission(artist_id):
 			updateArtist.description = description
 			
 			db.session.commit()
+			suggest_index.add('artist', artist_id, name)
+			page_cache.delete(*artist_cache_keys(artist_id))
 		except:
 			error = True
 			db.session.rollback()
@@ -419,7 +727,7 @@ def edit_venue(venue_id):
 	form.state.data = venue.state
 	form.address.data = venue.address
 	form.phone.data = venue.phone
-	form.genres.data = venue.genres
+	form.genres.data = [genre.name for genre in venue.genre_list]
 	form.facebook_link.data = venue.facebook_link
 	form.image_link.data = venue.image_link
 	form.website_link.data = venue.website_link
@@ -434,6 +742,7 @@ def edit_venue_submission(venue_id):
 	# TODO: take values from the form submitted, and update existing
 	# venue record with ID <venue_id> using the new attributes
 	error = False
+	form = VenueForm(request.form)
 
 	if form.validate():
 		try:
@@ -457,7 +766,7 @@ def edit_venue_submission(venue_id):
 			updateVenue.state = state
 			updateVenue.address = address
 			updateVenue.phone = phone
-			updateVenue.genres = genres
+			set_genres(updateVenue, genres)
 			updateVenue.facebook_link = facebook_link
 			updateVenue.image_link = image_link
 			updateVenue.website_link = website_link
@@ -465,6 +774,8 @@ def edit_venue_submission(venue_id):
 			updateVenue.description = description
 			
 			db.session.commit()
+			suggest_index.add('venue', venue_id, name)
+			page_cache.delete(*venue_cache_keys(venue_id))
 		except:
 			error = True
 			db.session.rollback()
@@ -504,16 +815,18 @@ def create_artist_submission():
 			city = form.city.data
 			state = form.state.data
 			phone = form.phone.data
-			genres = ",".join(form.genres.data)
+			genres = form.genres.data
 			facebook_link = form.facebook_link.data
 			image_link = form.image_link.data
 			website_link = form.website_link.data
 			seeking_venue = form.seeking_venue.data
 			description = form.seeking_description.data
 
-			anArtist = Artist(name=name, city=city, state=state, phone=phone, genres=genres, facebook_link=facebook_link, image_link=image_link, website_link=website_link, looking_for_venues=seeking_venue, description=description)
+			anArtist = Artist(name=name, city=city, state=state, phone=phone, facebook_link=facebook_link, image_link=image_link, website_link=website_link, looking_for_venues=seeking_venue, description=description)
+			set_genres(anArtist, genres)
 			db.session.add(anArtist)
 			db.session.commit()
+			suggest_index.add('artist', anArtist.id, name)
 		except:
 			error = True
 			db.session.rollback()
@@ -539,17 +852,42 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 @app.route('/shows')
+@read_replica
+@conditional('venues', 'artists', 'Show')
 def shows():
 	# displays list of shows at /shows
 	# TODO: replace with real venues data.
 	
-	shows = Show.query.order_by(desc('id')).all()
-	for show in shows:
-		show.venue_name = show.venue.name
-		show.artist_name = show.artist.name
-		show.artist_image_link = show.artist.image_link
+	# keyset pagination: ?after=<id> returns the shows older than that id,
+	# so every page is an index range scan on the primary key no matter how deep.
+	after = request.args.get('after', type=int)
+	limit = page_limit()
+	
+	query = db.session.query(
+		Show.id,
+		Show.venue_id,
+		Venue.name.label('venue_name'),
+		Show.artist_id,
+		Artist.name.label('artist_name'),
+		Artist.image_link.label('artist_image_link'),
+		Show.start_time
+	).join(
+		Venue, Show.venue_id == Venue.id
+	).join(
+		Artist, Show.artist_id == Artist.id
+	)
+	if after is not None:
+		query = query.filter(Show.id < after)
+	
+	# fetch one extra row to know whether there is a next page
+	shows = query.order_by(Show.id.desc()).limit(limit + 1).all()
+	next_after = None
+	if len(shows) > limit:
+		shows = shows[:limit]
+		next_after = shows[-1].id
 	
-	return render_template('pages/shows.html', shows=shows)
+	start_times = format_datetimes([show.start_time for show in shows], 'full')
+	return render_template('pages/shows.html', shows=shows, start_times=start_times, after=after, next_after=next_after, limit=limit)
 
 @app.route('/shows/create')
 def create_shows():
@@ -567,13 +905,28 @@ def create_show_submission():
 	if form.validate():
 		try:
 			# get form data
-			artist_id = request.form.get('artist_id')
-			venue_id = request.form.get('venue_id')
-			start_time = request.form.get('start_time')
+			artist_id = int(request.form.get('artist_id'))
+			venue_id = int(request.form.get('venue_id'))
+			start_time = form.start_time.data
+			end_time = start_time + (timedelta(minutes=form.duration.data) if form.duration.data else DEFAULT_SHOW_DURATION)
 
-			aShow = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
-			db.session.add(aShow)
-			db.session.commit()
+			# a batch of one: unknown artists or venues and double bookings are refused
+			conflict = book_shows([{'artist_id': artist_id, 'venue_id': venue_id, 'start_time': start_time, 'end_time': end_time}])[0].get('error')
+			if conflict:
+				db.session.rollback()
+			else:
+				db.session.commit()
+				page_cache.delete('venue:{}'.format(venue_id), 'artist:{}'.format(artist_id))
+		except ValueError:
+			conflict = 'the artist and venue IDs must be numbers'
+			db.session.rollback()
+		except IntegrityError as e:
+			db.session.rollback()
+			if is_overlap_violation(e):
+				# on Postgres the exclusion constraints catch a concurrent overlapping booking
+				conflict = 'the venue or the artist was booked for that time meanwhile'
+			else:
+				error = True
 		except:
 			error = True
 			db.session.rollback()
@@ -584,6 +937,8 @@ def create_show_submission():
 			flash('An error occurred. Show could not be listed.')
 			# see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
 			abort(500)
+		elif conflict:
+			flash('Show was not listed: {}.'.format(conflict))
 		else:
 			# on successful db insert, flash success
 			flash('The Show was successfully listed!')
@@ -593,6 +948,352 @@ def create_show_submission():
 	
 	return render_template('pages/home.html')
 
+@app.route('/shows/<int:show_id>', methods=['DELETE'])
+def delete_show(show_id):
+	error = False
+	try:
+		show = Show.query.get(show_id)
+		venue_id = show.venue_id
+		artist_id = show.artist_id
+		count_shows([(venue_id, artist_id, show.counted_as_past)], -1)
+		db.session.delete(show)
+		db.session.commit()
+		page_cache.delete('venue:{}'.format(venue_id), 'artist:{}'.format(artist_id))
+	except:
+		error = True
+		db.session.rollback()
+	finally:
+		db.session.close()
+	if error:
+		flash("Show was not deleted successfully.")
+	else:
+		flash("The Show was deleted successfully!")
+
+	return render_template('pages/home.html')
+
+#  Batch and recurring shows
+#  ----------------------------------------------------------------
+def batch_shows(form):
+	# the tour lines and the weekly residency of a ShowBatchForm as show dicts.
+	# Raises ValueError naming the first line that can't be read.
+	artist_id = form.artist_id.data
+	duration = timedelta(minutes=form.duration.data) if form.duration.data else DEFAULT_SHOW_DURATION
+	dates = []
+	for number, line in enumerate((form.dates.data or '').splitlines(), 1):
+		if not line.strip():
+			continue
+		try:
+			venue_id, start_time = line.split(',', 1)
+			dates.append((int(venue_id), dateutil.parser.parse(start_time)))
+		except (ValueError, OverflowError):
+			raise ValueError('line {}: expected "venue_id, YYYY-MM-DD HH:MM"'.format(number))
+	if form.venue_id.data or form.start_time.data or form.repeat.data:
+		if not (form.venue_id.data and form.start_time.data and form.repeat.data):
+			raise ValueError('a weekly residency needs a venue, a first show and a number of weeks')
+		if len(dates) + form.repeat.data > app.config['SHOW_BATCH_MAX']:
+			# check before weekly() builds the dates; a huge count would overflow the calendar
+			raise ValueError('at most {} shows per batch'.format(app.config['SHOW_BATCH_MAX']))
+		venue_id = form.venue_id.data
+		dates.extend((venue_id, start_time) for start_time in weekly(form.start_time.data, form.repeat.data, form.every.data or 1))
+	if not dates:
+		raise ValueError('no shows to book')
+	if len(dates) > app.config['SHOW_BATCH_MAX']:
+		raise ValueError('at most {} shows per batch'.format(app.config['SHOW_BATCH_MAX']))
+	return [{
+		'artist_id': artist_id,
+		'venue_id': venue_id,
+		'start_time': start_time,
+		'end_time': start_time + duration
+	} for venue_id, start_time in dates]
+
+@app.route('/shows/create/batch', methods=['GET'])
+def create_show_batch():
+	form = ShowBatchForm()
+	return render_template('forms/new_shows.html', form=form)
+
+@app.route('/shows/create/batch', methods=['POST'])
+def create_show_batch_submission():
+	# books every show of the batch in one transaction, or none of them.
+	# API clients post the same fields as a JSON object; browsers can't send a
+	# JSON body cross-site without a CORS preflight, so it needs no CSRF token
+	if request.is_json:
+		data = request.get_json(silent=True)
+		if not isinstance(data, dict):
+			return api_response({'booked': False, 'error': 'expected a JSON object', 'results': []}, 400)
+		form = ShowBatchForm(MultiDict(data), meta={'csrf': False})
+	else:
+		form = ShowBatchForm(request.form)
+	results = []
+	error = None
+	status = 201
+	
+	if not form.validate():
+		error = '; '.join('{}: {}'.format(name, ', '.join(messages)) for name, messages in form.errors.items())
+		status = 400
+	else:
+		try:
+			shows = batch_shows(form)
+			results = book_shows(shows)
+			if any('error' in result for result in results):
+				error = 'Nothing was booked: {} of {} shows conflict.'.format(sum('error' in result for result in results), len(results))
+				status = 409
+				db.session.rollback()
+			else:
+				db.session.commit()
+				page_cache.delete(*{key for show in shows for key in (
+					'venue:{}'.format(show['venue_id']), 'artist:{}'.format(show['artist_id']))})
+		except ValueError as e:
+			error = str(e)
+			status = 400
+			db.session.rollback()
+		except IntegrityError as e:
+			db.session.rollback()
+			if is_overlap_violation(e):
+				# on Postgres the exclusion constraints catch concurrent overlapping bookings
+				error = 'Nothing was booked: a show was booked for the same time meanwhile.'
+				status = 409
+			else:
+				error = 'An error occurred. Nothing was booked.'
+				status = 500
+		except:
+			error = 'An error occurred. Nothing was booked.'
+			status = 500
+			db.session.rollback()
+		finally:
+			db.session.close()
+	
+	if request.is_json or request.accept_mimetypes.best == 'application/json':
+		return api_response({'booked': error is None, 'error': error, 'results': results}, status)
+	if error:
+		flash(error)
+	else:
+		flash('{} shows were successfully listed!'.format(len(results)))
+	return render_template('forms/new_shows.html', form=form, results=results), 200 if status == 201 else status
+
+#  Export
+#  ----------------------------------------------------------------
+@app.route('/export/<kind>.<fmt>')
+@read_replica
+def export(kind, fmt):
+	# full-catalog dump, streamed from a server-side cursor
+	if kind not in EXPORTS or fmt not in FORMATS:
+		abort(404)
+	rows = iter_export(kind, fmt, app.config['EXPORT_BATCH_SIZE'])
+	response = Response(stream_with_context(rows), mimetype=FORMATS[fmt])
+	response.headers['Content-Disposition'] = 'attachment; filename={}.{}'.format(kind, fmt)
+	return response
+
+#  JSON API
+#  ----------------------------------------------------------------
+def api_response(data, status=200):
+	return Response(api.dumps(data), status=status, mimetype='application/json')
+
+def api_fields():
+	# ?fields=name,city -> ['name', 'city'], or None for everything
+	value = request.args.get('fields', '')
+	return [name.strip() for name in value.split(',') if name.strip()] or None
+
+@app.route('/api/v1/<any(venues, artists, shows):kind>')
+@read_replica
+@conditional('venues', 'artists', 'Show')
+def api_list(kind):
+	# one page of rows in id order; ?after=<id> continues after a previous page
+	try:
+		fields = parse_fields(kind, request.args.get('fields'))
+	except ValueError as e:
+		return api_response({'error': str(e)}, 400)
+	after = request.args.get('after', type=int)
+	limit = page_limit()
+	
+	query = catalog_query(kind, fields)
+	if after is not None:
+		query = query.filter(MODELS[kind].id > after)
+	rows = query.limit(limit + 1).all()
+	next_after = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		next_after = rows[-1].id
+	
+	return api_response({
+		'data': api.row_dicts(rows, fields),
+		'next_after': next_after,
+		'next': url_for('api_list', kind=kind, after=next_after, limit=limit, fields=request.args.get('fields')) if next_after else None
+	})
+
+def api_detail(data):
+	# a detail document from the page cache, with upcoming/past split at request time
+	if data is None:
+		return api_response({'error': 'not found'}, 404)
+	upcoming_shows, past_shows = split_shows(data['shows'])
+	data = dict(data, upcoming_shows=upcoming_shows, past_shows=past_shows,
+		upcoming_shows_count=len(upcoming_shows), past_shows_count=len(past_shows))
+	del data['shows']
+	fields = api_fields()
+	unknown = [name for name in fields or [] if name not in data]
+	if unknown:
+		return api_response({'error': 'unknown field {!r}'.format(unknown[0])}, 400)
+	return api_response(api.project(data, fields))
+
+@app.route('/api/v1/venues/<int:venue_id>')
+@read_replica
+@conditional('venues', 'artists', 'Show', time_sensitive=True)
+def api_venue(venue_id):
+	return api_detail(cached_page_data('venue:{}'.format(venue_id), lambda: venue_page_data(venue_id)))
+
+@app.route('/api/v1/artists/<int:artist_id>')
+@read_replica
+@conditional('venues', 'artists', 'Show', time_sensitive=True)
+def api_artist(artist_id):
+	return api_detail(cached_page_data('artist:{}'.format(artist_id), lambda: artist_page_data(artist_id)))
+
+@app.route('/api/v1/shows/<int:show_id>')
+@read_replica
+@conditional('venues', 'artists', 'Show')
+def api_show(show_id):
+	try:
+		fields = parse_fields('shows', request.args.get('fields'))
+	except ValueError as e:
+		return api_response({'error': str(e)}, 400)
+	row = catalog_query('shows', fields).filter(Show.id == show_id).first()
+	if row is None:
+		return api_response({'error': 'not found'}, 404)
+	return api_response(api.row_dicts([row], fields)[0])
+
+#  Availability
+#  ----------------------------------------------------------------
+def availability_window():
+	# ?from=&to= as dates or datetimes (a bare "to" date includes that whole
+	# day), default the next 7 days; ?min= minimum free slot in minutes
+	def parse(name, default, endOfDay=False):
+		value = request.args.get(name)
+		if not value:
+			return default
+		if len(value) == 10:
+			day = datetime.strptime(value, '%Y-%m-%d')
+			return day + timedelta(days=1) if endOfDay else day
+		value = dateutil.parser.parse(value)
+		if value.tzinfo is not None:
+			# show times are naive local times; an offset can't be compared with them
+			raise ValueError('{} must be a local time without a UTC offset'.format(name))
+		return value
+	start = parse('from', datetime.now().replace(second=0, microsecond=0))
+	end = parse('to', start + timedelta(days=7), endOfDay=True)
+	minLength = timedelta(minutes=request.args.get('min', 0, type=int))
+	if end <= start or end - start > timedelta(days=app.config['AVAILABILITY_MAX_DAYS']):
+		raise ValueError('the window must be between 1 minute and {} days'.format(app.config['AVAILABILITY_MAX_DAYS']))
+	return start, end, minLength
+
+def availability_response(kind, id, column):
+	try:
+		start, end, minLength = availability_window()
+	except (ValueError, OverflowError) as e:
+		return api_response({'error': str(e)}, 400)
+	busy = busy_times(column, id, start, end)
+	return api_response({
+		kind + '_id': id,
+		'from': start,
+		'to': end,
+		'busy': [{'start': showStart, 'end': showEnd} for showStart, showEnd in busy],
+		'free': [{'start': slotStart, 'end': slotEnd} for slotStart, slotEnd in free_slots(busy, start, end, minLength)]
+	})
+
+@app.route('/venues/<int:venue_id>/availability')
+@read_replica
+@conditional('Show', time_sensitive=True)
+def venue_availability(venue_id):
+	return availability_response('venue', venue_id, Show.venue_id)
+
+@app.route('/artists/<int:artist_id>/availability')
+@read_replica
+@conditional('Show', time_sensitive=True)
+def artist_availability(artist_id):
+	return availability_response('artist', artist_id, Show.artist_id)
+
+@app.route('/venues/availability')
+@read_replica
+@conditional('venues', 'Show', time_sensitive=True)
+def venues_free():
+	# which venues (in ?city=/&state=) have a free slot in the window
+	try:
+		start, end, minLength = availability_window()
+	except (ValueError, OverflowError) as e:
+		return api_response({'error': str(e)}, 400)
+	venues = venues_availability(start, end, minLength, request.args.get('city'), request.args.get('state'))
+	return api_response({
+		'from': start,
+		'to': end,
+		'venues': [{
+			'id': id,
+			'name': name,
+			'free': [{'start': slotStart, 'end': slotEnd} for slotStart, slotEnd in slots]
+		} for id, name, slots in venues]
+	})
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORTS)))
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='jsonl', show_default=True)
+def export_rows(kind, output, fmt):
+	"""Dump all venues, artists or shows as CSV or JSON Lines."""
+	for chunk in iter_export(kind, fmt, app.config['EXPORT_BATCH_SIZE']):
+		output.write(chunk)
+
+@app.cli.command('rollover-shows')
+def rollover_shows():
+	"""Move shows that have started from the upcoming to the past counters."""
+	moved = roll_over_shows()
+	print('Rolled over {} shows.'.format(moved))
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Default: from the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per insert/transaction.')
+@click.option('--rejects', type=click.Path(dir_okay=False), help='Write rejected rows here as JSON Lines.')
+def import_rows(kind, path, fmt, batch_size, rejects):
+	"""Bulk import venues, artists or shows from CSV or JSON Lines."""
+	rejectsFile = open(rejects, 'w', encoding='utf-8') if rejects else None
+
+	def on_reject(number, row, errors):
+		if rejectsFile:
+			rejectsFile.write(json.dumps({'line': number, 'row': row, 'errors': errors}, default=str) + '\n')
+		else:
+			print('line {}: {}'.format(number, errors), file=sys.stderr)
+
+	def on_batch(stats):
+		print('{read} read, {imported} imported, {rejected} rejected ({rate:.0f} rows/s)'.format(
+			rate=stats['read'] / stats['seconds'] if stats['seconds'] else 0, **stats))
+
+	try:
+		stats = Importer(kind, batch_size, on_reject, on_batch, cache=page_cache).run(read_rows(path, fmt))
+	finally:
+		if rejectsFile:
+			rejectsFile.close()
+	on_batch(stats)
+	print('Imported {} {} in {:.2f}s.'.format(stats['imported'], kind, stats['seconds']))
+
+@app.cli.command('slow-queries')
+@click.option('--log', 'path', type=click.Path(exists=True, dir_okay=False), help='Default: SLOW_QUERY_LOG.')
+@click.option('--sort', type=click.Choice(['total', 'count', 'max', 'mean']), default='total', show_default=True)
+@click.option('--limit', default=10, show_default=True, help='Statements to show.')
+@click.option('--plans/--no-plans', default=True, help='Show the plan of each statement\'s slowest run.')
+def slow_queries(path, sort, limit, plans):
+	"""Rank the statements in the slow-query log, worst first."""
+	with open(path or app.config['SLOW_QUERY_LOG'], encoding='utf-8') as logFile:
+		offenders = slowlog.top_offenders(logFile, sort)
+	for rank, offender in enumerate(offenders[:limit], 1):
+		sources = ', '.join('{} ({})'.format(source, count) for source, count in
+			sorted(offender['sources'].items(), key=lambda item: -item[1]))
+		print('#{} {count} runs, {total_ms:.1f} ms total, {mean_ms:.1f} ms mean, {max_ms:.1f} ms max'.format(rank, **offender))
+		print('   from: {}'.format(sources))
+		print('   {}'.format(offender['statement']))
+		if plans and offender['plan']:
+			print('   plan (slowest run, parameters {}):'.format(json.dumps(offender['parameters'], default=str)))
+			for line in offender['plan'].splitlines():
+				print('     {}'.format(line))
+		print()
+	print('{} distinct statements in the log.'.format(len(offenders)))
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
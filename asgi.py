@@ -0,0 +1,452 @@
+# Imports
+import asyncio
+import io
+import random
+import re
+import sys
+import time
+from itertools import groupby
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+
+from flask import session
+from jinja2 import Environment
+from sqlalchemy import and_, or_, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+
+from app import app as flask_app, split_shows, page_cache, page_validators
+from dates import format_datetimes
+from metrics import async_request, record_request
+from models import Venue, Artist, Show, Genre, TableVersion, venue_genres, artist_genres
+from profiler import requested_mode
+from routing import STICKY_KEY
+
+#----------------------------------------------------------------------------#
+# ASGI entry point.
+#
+# The read pages (/venues, /artists, /shows and the venue/artist detail
+# pages) served with async SQLAlchemy and Jinja's async rendering, so one
+# worker can keep many requests waiting on the database at once. They answer
+# with the Flask views' ETag/Last-Modified (304s included), read from a
+# replica when there are any and are counted in /metrics. Everything else
+# runs the Flask app in a worker thread: search and the other routes, query
+# options these handlers don't cover, and requests for these pages that have
+# a flash message to show, read their own writes (routing.py) or ask to be
+# profiled.
+#
+#     uvicorn asgi:app --workers 4
+#
+# Needs SQLAlchemy's asyncio extra and an async driver: asyncpg for
+# Postgres, aiosqlite for SQLite.
+#----------------------------------------------------------------------------#
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_engine(config, database_url):
+    # an AsyncEngine for database_url, with the Flask app's pool settings
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    url = url.set(drivername=ASYNC_DRIVERS[backend])
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING'], 'pool_recycle': config['DB_POOL_RECYCLE']}
+    # aiosqlite gets a NullPool (SQLAlchemy 1.4) or StaticPool, which take no sizes
+    if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        options.update({
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+        })
+    if backend == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(config['DB_STATEMENT_TIMEOUT_MS'])}}
+    return create_async_engine(url, **options)
+
+
+engine = async_engine(flask_app.config, flask_app.config['SQLALCHEMY_DATABASE_URI'])
+replicas = [async_engine(flask_app.config, url) for url in flask_app.config['REPLICA_URLS']]
+
+# the Flask app's templates, filters and URLs, rendered asynchronously
+templates = Environment(loader=flask_app.jinja_loader, autoescape=True, enable_async=True)
+templates.filters.update(flask_app.jinja_env.filters)
+urls = flask_app.url_map.bind('localhost')
+templates.globals.update(
+    url_for=lambda endpoint, **values: urls.build(endpoint, values),
+    # requests with flash messages to show are left to Flask (flask_only())
+    get_flashed_messages=lambda *args, **kwargs: [],
+)
+
+
+async def render(template_name, endpoint, **context):
+    template = templates.get_template(template_name)
+    return await template.render_async(request=SimpleNamespace(endpoint=endpoint), **context)
+
+
+def flask_only(environ):
+    # whether Flask has to serve this page: there is a flash message to show,
+    # the client reads its own writes from the primary, or wants a profile
+    with flask_app.request_context(environ):
+        return bool(session.get('_flashes')) or session.get(STICKY_KEY, 0) > time.time() or requested_mode() is not None
+
+
+async def table_versions(conn, names):
+    # models.table_versions() on an async connection
+    rows = (await conn.execute(select(TableVersion.name, TableVersion.version, TableVersion.updated_at).where(
+        TableVersion.name.in_(names)
+    ))).all()
+    return {row.name: (row.version, row.updated_at) for row in rows}
+
+
+def page_limit(args):
+    # ?limit= clamped like app.page_limit()
+    try:
+        limit = int(args.get('limit', flask_app.config['PAGE_SIZE']))
+    except ValueError:
+        limit = flask_app.config['PAGE_SIZE']
+    return max(1, min(limit, flask_app.config['MAX_PAGE_SIZE']))
+
+
+def int_arg(args, name):
+    try:
+        return int(args[name]) if args.get(name) else None
+    except ValueError:
+        return None
+
+#----------------------------------------------------------------------------#
+# Read pages. Same queries and template data as the Flask views.
+#----------------------------------------------------------------------------#
+
+async def venues(conn, args):
+    query = select(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        Venue.upcoming_shows_count.label('num_upcoming_shows')
+    )
+    genre = args.get('genre')
+    if genre:
+        query = query.join(
+            venue_genres, venue_genres.c.venue_id == Venue.id
+        ).join(
+            Genre, Genre.id == venue_genres.c.genre_id
+        ).where(Genre.name == genre)
+    rows = (await conn.execute(query.order_by(Venue.state, Venue.city, Venue.id))).all()
+
+    areas = [{
+        'city': city,
+        'state': state,
+        'venues': [{'id': venue.id, 'name': venue.name, 'num_upcoming_shows': venue.num_upcoming_shows} for venue in areaVenues]
+    } for (state, city), areaVenues in groupby(rows, key=lambda venue: (venue.state, venue.city))]
+    return await render('pages/venues.html', 'venues', areas=areas, genre=genre)
+
+
+async def artists(conn, args):
+    if args.get('stream'):
+        return None
+    sort = args.get('sort', 'recent')
+    if sort not in ('recent', 'name'):
+        sort = 'recent'
+    query = select(Artist.id, Artist.name)
+    genre = args.get('genre')
+    if genre:
+        query = query.join(
+            artist_genres, artist_genres.c.artist_id == Artist.id
+        ).join(
+            Genre, Genre.id == artist_genres.c.genre_id
+        ).where(Genre.name == genre)
+    query = query.order_by(Artist.name, Artist.id) if sort == 'name' else query.order_by(Artist.id.desc())
+
+    after = int_arg(args, 'after')
+    limit = page_limit(args)
+    if after is not None:
+        if sort == 'name':
+            afterName = select(Artist.name).where(Artist.id == after).scalar_subquery()
+            query = query.where(or_(Artist.name > afterName, and_(Artist.name == afterName, Artist.id > after)))
+        else:
+            query = query.where(Artist.id < after)
+
+    rows = (await conn.execute(query.limit(limit + 1))).all()
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1].id
+    return await render('pages/artists.html', 'artists', artists=rows, sort=sort, genre=genre, after=after, next_after=next_after, limit=limit)
+
+
+async def shows(conn, args):
+    after = int_arg(args, 'after')
+    limit = page_limit(args)
+    query = select(
+        Show.id,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Show.start_time
+    ).join(
+        Venue, Show.venue_id == Venue.id
+    ).join(
+        Artist, Show.artist_id == Artist.id
+    )
+    if after is not None:
+        query = query.where(Show.id < after)
+
+    rows = (await conn.execute(query.order_by(Show.id.desc()).limit(limit + 1))).all()
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1].id
+    start_times = format_datetimes([row.start_time for row in rows], 'full')
+    return await render('pages/shows.html', 'shows', shows=rows, start_times=start_times, after=after, next_after=next_after, limit=limit)
+
+
+async def venue_page_data(conn, venue_id):
+    # same data as app.venue_page_data(), so both apps share cache entries
+    venue = (await conn.execute(select(Venue.__table__).where(Venue.id == venue_id))).first()
+    if venue is None:
+        return None
+    shows = (await conn.execute(select(
+        Show.artist_id, Artist.name, Artist.image_link, Show.start_time
+    ).join(
+        Artist, Show.artist_id == Artist.id
+    ).where(
+        Show.venue_id == venue_id
+    ).order_by(Show.start_time))).all()
+    return {
+        "id": venue.id,
+        "name": venue.name,
+        "genres": venue.genres.split(",") if venue.genres else [],
+        "address": venue.address,
+        "city": venue.city,
+        "state": venue.state,
+        "phone": venue.phone,
+        "website": venue.website_link,
+        "facebook_link": venue.facebook_link,
+        "seeking_talent": venue.looking_for_talent,
+        "seeking_description": venue.description,
+        "image_link": venue.image_link,
+        "shows": [{
+            "artist_id": show.artist_id,
+            "artist_name": show.name,
+            "artist_image_link": show.image_link,
+            "start_time": show.start_time
+        } for show in shows]
+    }
+
+
+async def artist_page_data(conn, artist_id):
+    # same data as app.artist_page_data(), so both apps share cache entries
+    artist = (await conn.execute(select(Artist.__table__).where(Artist.id == artist_id))).first()
+    if artist is None:
+        return None
+    shows = (await conn.execute(select(
+        Show.venue_id, Venue.name, Venue.image_link, Show.start_time
+    ).join(
+        Venue, Show.venue_id == Venue.id
+    ).where(
+        Show.artist_id == artist_id
+    ).order_by(Show.start_time))).all()
+    return {
+        "id": artist.id,
+        "name": artist.name,
+        "genres": artist.genres.split(",") if artist.genres else [],
+        "city": artist.city,
+        "state": artist.state,
+        "phone": artist.phone,
+        "website": artist.website_link,
+        "facebook_link": artist.facebook_link,
+        "seeking_venue": artist.looking_for_venues,
+        "seeking_description": artist.description,
+        "image_link": artist.image_link,
+        "shows": [{
+            "venue_id": show.venue_id,
+            "venue_name": show.name,
+            "venue_image_link": show.image_link,
+            "start_time": show.start_time
+        } for show in shows]
+    }
+
+
+async def detail(conn, kind, id, build, template_name, endpoint):
+    key = '{}:{}'.format(kind, id)
+    data = page_cache.get(key)
+    if data is None:
+        data = await build(conn, id)
+        page_cache.set(key, data)
+    if data is None:
+        return await render('errors/404.html', endpoint)
+    upcoming_shows, past_shows = split_shows(data['shows'])
+    data = dict(
+        data,
+        upcoming_shows=upcoming_shows,
+        upcoming_shows_count=len(upcoming_shows),
+        past_shows=past_shows,
+        past_shows_count=len(past_shows)
+    )
+    return await render(template_name, endpoint, **{kind: data})
+
+
+async def show_venue(conn, args, venue_id):
+    return await detail(conn, 'venue', int(venue_id), venue_page_data, 'pages/show_venue.html', 'show_venue')
+
+
+async def show_artist(conn, args, artist_id):
+    return await detail(conn, 'artist', int(artist_id), artist_page_data, 'pages/show_artist.html', 'show_artist')
+
+
+# (path, handler, tables and time_sensitive of the view's @conditional)
+ROUTES = [
+    (re.compile(r'^/venues/?$'), venues, ('venues',), False),
+    (re.compile(r'^/venues/(\d+)$'), show_venue, ('venues', 'artists', 'Show'), True),
+    (re.compile(r'^/artists/?$'), artists, ('artists',), False),
+    (re.compile(r'^/artists/(\d+)$'), show_artist, ('venues', 'artists', 'Show'), True),
+    (re.compile(r'^/shows/?$'), shows, ('venues', 'artists', 'Show'), False),
+]
+
+
+async def page(environ, full_path, handler, groups, tables, time_sensitive):
+    # (status, headers, body) for a read page, as the Flask view and its
+    # @conditional would answer; None when the handler leaves it to Flask
+    async with (random.choice(replicas) if replicas else engine).connect() as conn:
+        etag, lastModified = page_validators(full_path, tables, await table_versions(conn, tables), time_sensitive)
+        if not is_resource_modified(environ, etag=etag, last_modified=lastModified):
+            status, body = 304, b''
+        else:
+            html = await handler(conn, dict(parse_qsl(environ['QUERY_STRING'])), *groups)
+            if html is None:
+                return None
+            status, body = 200, html.encode('utf-8')
+    headers = [
+        (b'etag', quote_etag(etag).encode('latin-1')),
+        (b'last-modified', http_date(lastModified).encode('latin-1')),
+        (b'cache-control', b'no-cache'),
+    ]
+    if status == 200:
+        headers += [(b'content-type', b'text/html; charset=utf-8'), (b'content-length', str(len(body)).encode())]
+    return status, headers, body
+
+#----------------------------------------------------------------------------#
+# ASGI application.
+#----------------------------------------------------------------------------#
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    if scope['method'] in ('GET', 'HEAD'):
+        for pattern, handler, tables, time_sensitive in ROUTES:
+            match = pattern.match(scope['path'])
+            if match:
+                environ = wsgi_environ(scope, b'')
+                if flask_only(environ):
+                    break
+                full_path = flask_app.request_class(environ).full_path
+                counts = [0, 0.0]
+                token = async_request.set(counts)
+                started = time.perf_counter()
+                try:
+                    response = await page(environ, full_path, handler, match.groups(), tables, time_sensitive)
+                finally:
+                    async_request.reset(token)
+                if response is not None:
+                    status, headers, body = response
+                    # handler names are the Flask endpoints, so both apps share metrics
+                    timing = record_request(flask_app.config, handler.__name__, scope['method'], full_path, status,
+                                            time.perf_counter() - started, counts[0], counts[1])
+                    headers.append((b'server-timing', timing.encode('latin-1')))
+                    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+                    await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+                    return
+                break
+    await call_flask(scope, receive, send)
+
+
+def wsgi_environ(scope, body):
+    # the WSGI environ of an ASGI HTTP request
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def call_flask(scope, receive, send):
+    # run the Flask (WSGI) app for this request in a worker thread
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    environ = wsgi_environ(scope, body)
+
+    loop = asyncio.get_running_loop()
+
+    def run():
+        # in the worker thread: send each chunk as the app yields it, so
+        # streamed responses (exports, /artists?stream=1) are never held whole
+        def forward(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = {}
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        def start():
+            forward({'type': 'http.response.start', 'status': started['status'], 'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in started.pop('headers')
+            ]})
+
+        result = flask_app(environ, start_response)
+        try:
+            for chunk in result:
+                if 'headers' in started:
+                    start()
+                if chunk:
+                    forward({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if 'headers' in started:
+                start()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        forward({'type': 'http.response.body', 'body': b''})
+
+    await loop.run_in_executor(None, run)
@@ -0,0 +1,145 @@
+"""
+Throughput of the read pages served by the Flask app (threads) and by the
+ASGI entry point in asgi.py (async SQLAlchemy + async templates).
+
+Seeds a synthetic dataset, then drives the same random mix of read URLs
+through each app in-process: the Flask app from a pool of threads, the ASGI
+app from asyncio tasks through httpx. Prints requests/second and latency
+percentiles for both as JSON. The detail page cache is off unless --cache.
+
+    python benchmarks/async_vs_sync.py --database sqlite:////tmp/fyyur-async.db
+    python benchmarks/async_vs_sync.py --database postgresql://localhost/fyyur_bench --concurrency 64
+
+Needs httpx and an async driver (aiosqlite or asyncpg). The target database
+is dropped and recreated; never point this at real data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def summary(name, latencies, seconds, errors):
+    return {
+        'app': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+    }
+
+
+def run_sync(app, urls, concurrency):
+    def fetch(url):
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, urls))
+    seconds = time.perf_counter() - started
+    return summary('flask (threads)', [latency for latency, _ in results], seconds,
+                   sum(1 for _, status in results if status != 200))
+
+
+async def run_async(asgi_app, urls, concurrency):
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url='http://bench') as client:
+        async def fetch(url):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url)
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[fetch(url) for url in urls])
+        seconds = time.perf_counter() - started
+    return summary('asgi (async)', [latency for latency, _ in results], seconds,
+                   sum(1 for _, status in results if status != 200))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/fyyur-async.db')
+    parser.add_argument('--venues', type=int, default=500)
+    parser.add_argument('--artists', type=int, default=2000)
+    parser.add_argument('--shows', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cache', action='store_true', help='keep the detail page cache on')
+    args = parser.parse_args()
+
+    import config
+    config.SQLALCHEMY_DATABASE_URI = args.database
+    config.REPLICA_URLS = []
+    config.SQLALCHEMY_BINDS = {}
+    config.REPLICA_BINDS = []
+    config.SLOW_QUERY_MS = 0
+    if not args.cache:
+        config.CACHE_BACKEND = 'null'
+    config.DB_POOL_SIZE = max(config.DB_POOL_SIZE, args.concurrency)
+    from app import app
+    from models import db
+    import asgi
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        generate(db, args.venues, args.artists, args.shows, rng)
+
+    pages = ['/venues', '/artists', '/artists?sort=name', '/shows']
+    urls = []
+    for _ in range(args.requests):
+        choice = rng.random()
+        if choice < 0.4:
+            urls.append('/venues/{}'.format(rng.randint(1, args.venues)))
+        elif choice < 0.8:
+            urls.append('/artists/{}'.format(rng.randint(1, args.artists)))
+        else:
+            urls.append(rng.choice(pages))
+
+    async def run_async_warm():
+        # the async pool is bound to one event loop: warm up and measure in it
+        await run_async(asgi.app, urls[:50], args.concurrency)
+        return await run_async(asgi.app, urls, args.concurrency)
+
+    # warm up (imports, template compilation, pools) before measuring
+    run_sync(app, urls[:50], args.concurrency)
+    results = [
+        run_sync(app, urls, args.concurrency),
+        asyncio.run(run_async_warm()),
+    ]
+    print(json.dumps({
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1],
+        'concurrency': args.concurrency,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Query plans behind each read route, without and with the indexes from
+migration c4a81d5e2f07 (models.QUERY_INDEXES).
+
+Seeds a synthetic dataset, drives every read route through the Flask test
+client to capture the SQL it actually runs, then EXPLAINs each statement
+and times it with the indexes dropped and again with them created.
+
+    python benchmarks/query_plans.py --database sqlite:////tmp/fyyur-plans.db
+    python benchmarks/query_plans.py --database postgresql://localhost/fyyur_bench --analyze
+
+The target database is dropped and recreated; never point this at real data.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate
+
+
+def capture(app, db, requests):
+    # run each request and record the SQL statements it executes. Each one
+    # runs once unrecorded first, so one-off lookups (the search backend's
+    # index probe, cache fills) don't show up in only one of the two runs.
+    from sqlalchemy import event
+
+    captured = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    client = app.test_client()
+    results = []
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        for method, url, data in requests:
+            client.open(url, method=method, data=data)
+            del captured[:]
+            client.open(url, method=method, data=data)
+            results.append(((method, url), list(captured)))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return results
+
+
+def explain(db, statement, parameters, analyze, repeat):
+    # (plan lines, median execution time in ms) for one captured statement
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif analyze:
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+    else:
+        prefix = 'EXPLAIN '
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+        plan = [' '.join(str(value) for value in row[-1:]) if dialect == 'sqlite' else row[0] for row in rows]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            connection.exec_driver_sql(statement, parameters).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+    return plan, statistics.median(timings)
+
+
+def pair(route, before, after):
+    # match a route's statements from both runs by query shape (the same
+    # statement may come with other literals or in another order) and fail
+    # loudly when the two runs didn't run the same statements
+    from slowlog import fingerprint
+
+    shapes = defaultdict(deque)
+    for statement in after:
+        shapes[fingerprint(statement[0])].append(statement)
+    pairs = []
+    for statement in before:
+        matches = shapes.get(fingerprint(statement[0]))
+        if not matches:
+            break
+        pairs.append((statement, matches.popleft()))
+    if len(pairs) != len(before) or len(before) != len(after):
+        raise SystemExit('{} {} ran different statements without ({}) and with ({}) the indexes'.format(
+            route[0], route[1], len(before), len(after)))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/fyyur-plans.db')
+    parser.add_argument('--venues', type=int, default=2000)
+    parser.add_argument('--artists', type=int, default=5000)
+    parser.add_argument('--shows', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per statement')
+    parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE on Postgres')
+    args = parser.parse_args()
+
+    # point the app at the benchmark database, with page caching off so
+    # every request reaches the database
+    import config
+    config.SQLALCHEMY_DATABASE_URI = args.database
+    config.CACHE_BACKEND = 'null'
+    config.SLOW_QUERY_MS = 0
+    from app import app, search_backend
+    from models import db, QUERY_INDEXES
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        generate(db, args.venues, args.artists, args.shows, rng)
+        search_backend().install()
+
+        venueId = rng.randint(1, args.venues)
+        artistId = rng.randint(1, args.artists)
+        requests = [
+            ('GET', '/venues', None),
+            ('GET', '/venues?genre=Jazz', None),
+            ('GET', '/venues/{}'.format(venueId), None),
+            ('GET', '/artists', None),
+            ('GET', '/artists?sort=name&after={}'.format(artistId), None),
+            ('GET', '/artists?genre=Blues', None),
+            ('GET', '/artists/{}'.format(artistId), None),
+            ('GET', '/shows', None),
+            ('GET', '/shows?after={}'.format(args.shows // 2), None),
+            ('POST', '/venues/search', {'search_term': 'musical hop'}),
+            ('POST', '/artists/search', {'search_term': 'band'}),
+        ]
+
+        # reflection can't see expression indexes, so drop by name
+        with db.engine.begin() as connection:
+            for index in QUERY_INDEXES:
+                connection.exec_driver_sql('DROP INDEX IF EXISTS "{}"'.format(index.name))
+        before = capture(app, db, requests)
+        before = [(route, [(s, p) + explain(db, s, p, args.analyze, args.repeat) for s, p in statements]) for route, statements in before]
+
+        for index in QUERY_INDEXES:
+            index.create(db.engine)
+        after = capture(app, db, requests)
+        after = [(route, [(s, p) + explain(db, s, p, args.analyze, args.repeat) for s, p in statements]) for route, statements in after]
+        dialect = db.engine.dialect.name
+
+    report = [(route, pair(route, beforeStatements, afterStatements)) for (route, beforeStatements), (_, afterStatements) in zip(before, after)]
+    print('{} venues, {} artists, {} shows on {}\n'.format(args.venues, args.artists, args.shows, dialect))
+    for route, pairs in report:
+        print('=' * 78)
+        print('{} {}'.format(*route))
+        for (statement, _, planBefore, msBefore), (_, _, planAfter, msAfter) in pairs:
+            print('-' * 78)
+            print(' '.join(statement.split())[:300])
+            print('  without indexes: {:.2f} ms'.format(msBefore))
+            for line in planBefore:
+                print('    ' + line)
+            print('  with indexes:    {:.2f} ms'.format(msAfter))
+            for line in planAfter:
+                print('    ' + line)
+        print()
+
+
+if __name__ == '__main__':
+    main()
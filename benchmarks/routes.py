@@ -0,0 +1,220 @@
+"""
+Latency and queries per request for every read route.
+
+Generates a synthetic catalog with synthetic.py (in a child process, so
+seeding doesn't count towards peak RSS), then drives every GET route in the
+app's URL map, plus the two search forms, through the Flask test client.
+Routes that write (create/edit/delete) are left out so runs stay comparable.
+Prints p50/p95/p99 latency and queries per request for each route, and the
+process's peak RSS, as JSON. Exits non-zero if any request fails with a
+5xx, so a small run doubles as a smoke test (see `fab test`).
+
+    python benchmarks/routes.py --database sqlite:////tmp/fyyur-bench.db --output before.json
+    python benchmarks/routes.py --database sqlite:////tmp/fyyur-bench.db --reuse --compare before.json
+    python benchmarks/routes.py --database postgresql://localhost/fyyur_bench --venues 10000 --artists 100000 --shows 1000000
+
+The page cache, slow-query log and profiler are off unless --cache. The
+target database is dropped and recreated unless --reuse; never point this at
+real data.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_vs_sync import percentile
+
+# extra query strings per endpoint, each benchmarked as its own route
+VARIANTS = {
+    'search_suggest': ['q=mu', 'q=band&type=artist'],
+    'venues': ['', 'genre=Jazz'],
+    'artists': ['', 'sort=name', 'genre=Blues'],
+    'shows': ['', 'after={show_id}'],
+    'api_list': ['', 'fields=id'],
+    'venues_free': ['city=San Francisco&state=CA&min=180'],
+}
+
+# form posts that only read
+POSTS = [
+    ('/venues/search', {'search_term': 'musical hop'}),
+    ('/artists/search', {'search_term': 'band'}),
+]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def build_requests(app, args, rng):
+    # (label, method, url factory, form data) for every read route
+    from exporter import EXPORTS, FORMATS
+
+    values = {
+        'venue_id': lambda: rng.randint(1, args.venues),
+        'artist_id': lambda: rng.randint(1, args.artists),
+        'show_id': lambda: rng.randint(1, args.shows),
+        'kind': lambda: rng.choice(sorted(EXPORTS)),
+        'fmt': lambda: rng.choice(sorted(FORMATS)),
+    }
+    exclude = re.compile(args.exclude) if args.exclude else None
+    adapter = app.url_map.bind('localhost')
+    requests = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if 'GET' not in rule.methods or rule.endpoint == 'static':
+            continue
+        for variant in VARIANTS.get(rule.endpoint, ['']):
+            label = 'GET {}{}'.format(rule.rule, '?' + variant if variant else '')
+            if exclude and exclude.search(label):
+                continue
+
+            def url(rule=rule, variant=variant):
+                arguments = {name: values[name]() for name in rule.arguments}
+                query = variant.format(**{name: make() for name, make in values.items()})
+                return adapter.build(rule.endpoint, arguments) + ('?' + query if query else '')
+            requests.append((label, 'GET', url, None))
+    for path, data in POSTS:
+        label = 'POST {}'.format(path)
+        if not (exclude and exclude.search(label)):
+            requests.append((label, 'POST', lambda path=path: path, data))
+    return requests
+
+
+def run(app, requests, count, warmup):
+    # time each request and count the SQL statements it runs
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    statements = [0]
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements[0] += 1
+
+    client = app.test_client()
+    results = []
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        for label, method, url, data in requests:
+            for _ in range(warmup):
+                client.open(url(), method=method, data=data).get_data()
+            latencies = []
+            queries = []
+            statuses = {}
+            for _ in range(count):
+                statements[0] = 0
+                target = url()
+                started = time.perf_counter()
+                response = client.open(target, method=method, data=data)
+                response.get_data()
+                latencies.append(time.perf_counter() - started)
+                queries.append(statements[0])
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            results.append({
+                'route': label,
+                'requests': count,
+                'statuses': {str(status): n for status, n in sorted(statuses.items())},
+                'errors': sum(n for status, n in statuses.items() if status >= 500),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+                'queries_per_request': round(statistics.mean(queries), 2),
+                'max_queries': max(queries),
+            })
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+    return results
+
+
+def compare(results, baseline):
+    # p50/p95 and queries per request against an earlier run's JSON
+    before = {route['route']: route for route in baseline['routes']}
+    changes = []
+    for route in results:
+        old = before.get(route['route'])
+        if old is None:
+            continue
+        changes.append({
+            'route': route['route'],
+            'p50_change': round(route['p50_ms'] / old['p50_ms'] - 1, 3) if old['p50_ms'] else None,
+            'p95_change': round(route['p95_ms'] / old['p95_ms'] - 1, 3) if old['p95_ms'] else None,
+            'queries_change': round(route['queries_per_request'] - old['queries_per_request'], 2),
+        })
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/fyyur-bench.db')
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=5000)
+    parser.add_argument('--shows', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reuse', action='store_true', help='benchmark the existing data (same volumes) instead of regenerating it')
+    parser.add_argument('--requests', type=int, default=30, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed requests per route first')
+    parser.add_argument('--exclude', help='skip routes whose "METHOD /rule?query" matches this regex')
+    parser.add_argument('--cache', action='store_true', help='keep the detail page cache on')
+    parser.add_argument('--output', help='also write the JSON report here')
+    parser.add_argument('--compare', type=argparse.FileType('r'), help='an earlier JSON report to compare with')
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    if not args.reuse:
+        subprocess.run([sys.executable, os.path.join(here, 'synthetic.py'), '--database', args.database,
+                        '--venues', str(args.venues), '--artists', str(args.artists), '--shows', str(args.shows),
+                        '--seed', str(args.seed)], check=True, stdout=subprocess.DEVNULL)
+
+    import config
+    config.SQLALCHEMY_DATABASE_URI = args.database
+    config.REPLICA_URLS = []
+    config.SQLALCHEMY_BINDS = {}
+    config.REPLICA_BINDS = []
+    config.SLOW_QUERY_MS = 0
+    config.PROFILING = False
+    config.QUERY_BUDGET = None
+    if not args.cache:
+        config.CACHE_BACKEND = 'null'
+    import sqlalchemy
+    from app import app
+    # a failing view is a 500 in the report, not a traceback
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    with app.app_context():
+        results = run(app, build_requests(app, args, rng), args.requests, args.warmup)
+    report = {
+        'database': args.database.split('@')[-1],
+        'venues': args.venues,
+        'artists': args.artists,
+        'shows': args.shows,
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'seconds': round(time.perf_counter() - started, 2),
+        'peak_rss_mb': peak_rss_mb(),
+        'errors': sum(route['errors'] for route in results),
+        'routes': results,
+    }
+    if args.compare:
+        report['compare'] = compare(results, json.load(args.compare))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as outputFile:
+            outputFile.write(output + '\n')
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
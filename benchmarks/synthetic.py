@@ -0,0 +1,157 @@
+"""
+Seeded synthetic catalog for benchmarks.
+
+Bulk-inserts venues, artists (with their genre links) and shows with core
+inserts, a batch at a time, so a million shows never sit in memory at once.
+No venue or artist has overlapping shows, and the upcoming/past show
+counters and counted_as_past flags are filled in as the app would have left
+them. The same --seed gives the same rows.
+
+    python benchmarks/synthetic.py --database sqlite:////tmp/fyyur-bench.db
+    python benchmarks/synthetic.py --database postgresql://localhost/fyyur_bench --venues 10000 --artists 100000 --shows 1000000
+
+The target database is dropped and recreated; never point this at real data.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop', 'Jazz', 'Pop', 'Punk', 'Rock n Roll', 'Soul']
+AREAS = [('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'), ('Brooklyn', 'NY'), ('Austin', 'TX'), ('Chicago', 'IL'), ('Seattle', 'WA'), ('Miami', 'FL')]
+WORDS = ['The', 'Musical', 'Hop', 'Park', 'Square', 'Live', 'Coffee', 'Dueling', 'Pianos', 'Bar', 'Wild', 'Sax', 'Band', 'Guns', 'Petals', 'Blue', 'Note', 'Velvet', 'Room']
+
+
+def batches(rows, size):
+    # lists of up to size items from any iterable
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(db, venues, artists, shows, rng, batch_size=5000, now=None):
+    # bulk-insert a synthetic catalog into an empty schema and commit it
+    from sqlalchemy import bindparam, text
+    from models import Venue, Artist, Show, Genre, venue_genres, artist_genres
+
+    now = now or datetime.now()
+
+    def name():
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4)))
+
+    db.session.execute(Genre.__table__.insert(), [{'id': i + 1, 'name': genre} for i, genre in enumerate(GENRES)])
+    for model, association, key, count in ((Venue, venue_genres, 'venue_id', venues), (Artist, artist_genres, 'artist_id', artists)):
+        for ids in batches(range(1, count + 1), batch_size):
+            rows = []
+            links = []
+            for id in ids:
+                city, state = rng.choice(AREAS)
+                genreIds = rng.sample(range(1, len(GENRES) + 1), rng.randint(1, 3))
+                rows.append({'id': id, 'name': '{} {}'.format(name(), id), 'city': city, 'state': state,
+                             'phone': '555-000-{:04d}'.format(id % 10000), 'image_link': 'https://example.com/{}.png'.format(id),
+                             'genres': ','.join(GENRES[i - 1] for i in genreIds), 'updated_at': now})
+                links.extend({'genre_id': genreId, key: id} for genreId in genreIds)
+            db.session.execute(model.__table__.insert(), rows)
+            db.session.execute(association.insert(), links)
+
+    # shows in consecutive time slots, each holding at most one show per venue
+    # and per artist, so nobody is double-booked (the app and the Postgres
+    # exclusion constraints both refuse that). The slots cover a year either
+    # side of now, longer if there are more of them than 4-hour slots fit;
+    # shows are 1-4 hours long and start anywhere in their slot.
+    perSlot = min(venues, artists)
+    slots = max(-(-shows // perSlot), 1)
+    slotLength = max(timedelta(days=2 * 365) / slots, timedelta(hours=4))
+    firstSlot = now - slotLength * slots / 2
+
+    def schedule():
+        for slot in range(slots):
+            slotStart = firstSlot + slotLength * slot
+            for venueId, artistId in zip(rng.sample(range(1, venues + 1), perSlot), rng.sample(range(1, artists + 1), perSlot)):
+                hours = rng.randint(1, 4)
+                start = slotStart + timedelta(hours=rng.randint(0, int((slotLength - timedelta(hours=hours)) / timedelta(hours=1))))
+                yield venueId, artistId, start, hours
+
+    venueCounts = Counter()
+    artistCounts = Counter()
+    for batch in batches(zip(range(1, shows + 1), schedule()), batch_size):
+        rows = []
+        for id, (venueId, artistId, start, hours) in batch:
+            past = start <= now
+            rows.append({'id': id, 'venue_id': venueId, 'artist_id': artistId, 'start_time': start,
+                         'end_time': start + timedelta(hours=hours), 'counted_as_past': past, 'updated_at': now})
+            venueCounts[(venueId, past)] += 1
+            artistCounts[(artistId, past)] += 1
+        db.session.execute(Show.__table__.insert(), rows)
+
+    # the counters count_shows()/roll_over_shows() would have kept
+    for model, counts in ((Venue, venueCounts), (Artist, artistCounts)):
+        table = model.__table__
+        totals = {}
+        for (id, past), n in counts.items():
+            totals.setdefault(id, [0, 0])[past] = n
+        update = table.update().where(table.c.id == bindparam('row_id')).values(
+            upcoming_shows_count=bindparam('upcoming'), past_shows_count=bindparam('past'))
+        for batch in batches(({'row_id': id, 'upcoming': upcoming, 'past': past} for id, (upcoming, past) in totals.items()), batch_size):
+            db.session.execute(update, batch)
+
+    # the ids above were explicit, so Postgres' serial sequences haven't moved;
+    # point them past the data or the app's next insert collides with id 1
+    if db.engine.dialect.name == 'postgresql':
+        quote = db.engine.dialect.identifier_preparer.quote
+        for model in (Genre, Venue, Artist, Show):
+            table = quote(model.__tablename__)
+            db.session.execute(text(
+                "SELECT setval(pg_get_serial_sequence(:table, 'id'), coalesce(max(id), 0) + 1, false) FROM " + table
+            ), {'table': table})
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/fyyur-bench.db')
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--artists', type=int, default=100000)
+    parser.add_argument('--shows', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    import config
+    config.SQLALCHEMY_DATABASE_URI = args.database
+    config.REPLICA_URLS = []
+    config.SQLALCHEMY_BINDS = {}
+    config.REPLICA_BINDS = []
+    config.SLOW_QUERY_MS = 0
+    from app import app, search_backend
+    from models import db
+
+    started = time.perf_counter()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        generate(db, args.venues, args.artists, args.shows, random.Random(args.seed), args.batch_size)
+        search_backend().install()
+    print(json.dumps({
+        'database': args.database.split('@')[-1],
+        'venues': args.venues,
+        'artists': args.artists,
+        'shows': args.shows,
+        'seed': args.seed,
+        'seconds': round(time.perf_counter() - started, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
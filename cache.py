@@ -0,0 +1,152 @@
+# Imports
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+#----------------------------------------------------------------------------#
+# Object cache.
+#
+# Read-through cache for assembled view data (e.g. the venue and artist
+# detail pages). Backends only know get/set/delete; ObjectCache adds the
+# read-through helper and the hit/miss counters.
+#----------------------------------------------------------------------------#
+
+
+class CacheBackend(object):
+    # interface for a cache store. Shared backends (Redis, memcached, ...)
+    # implement these three methods.
+
+    def get(self, key):
+        # return the cached value, or None on a miss
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    # caching disabled: every lookup is a miss
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+
+class MemoryCache(CacheBackend):
+    # bounded in-process LRU with a per-entry expiry time
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class RedisCache(CacheBackend):
+    # shared across workers and hosts, so an invalidation in one worker
+    # is seen by all of them. Needs the redis package.
+
+    def __init__(self, url, prefix='fyyur:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, int(ttl), pickle.dumps(value))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+
+class ObjectCache(object):
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return value
+
+    def set(self, key, value):
+        # None (e.g. row not found) is not cached
+        if value is not None:
+            self.backend.set(key, value, self.ttl)
+
+    def get_or_set(self, key, build):
+        # return the cached value for key, building and storing it on a miss.
+        # build() may return None (e.g. row not found), which is not cached.
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.set(key, value)
+        return value
+
+    def delete(self, *keys):
+        self.backend.delete(*keys)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def make_cache(config):
+    # build the cache described by the CACHE_* config values
+    name = config.get('CACHE_BACKEND', 'memory')
+    if name == 'redis':
+        backend = RedisCache(config['CACHE_REDIS_URL'])
+    elif name == 'memory':
+        backend = MemoryCache(config.get('CACHE_MAX_ENTRIES', 1024))
+    else:
+        backend = NullCache()
+    return ObjectCache(backend, config.get('CACHE_TTL', 300))
@@ -0,0 +1,72 @@
+# Imports
+from datetime import date, datetime
+from functools import lru_cache
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+#----------------------------------------------------------------------------#
+# Date formatting.
+#
+# The `datetime` template filter, without babel's per-call overhead: each
+# (format, locale) pattern is parsed once, datetimes are formatted directly
+# (strings are still parsed, for old callers), and recent results are
+# memoized, so re-rendering the same shows costs a dict lookup.
+# format_datetimes() formats a whole list of show times in one call.
+#----------------------------------------------------------------------------#
+
+# the app's named formats; any other string is a babel pattern
+PATTERNS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+# babel's own named formats, which it assembles from date and time parts
+BABEL_FORMATS = ('long', 'short')
+
+# formatted strings kept per process
+CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=None)
+def compiled(format, locale):
+    # (parsed pattern, Locale) for a format name or pattern
+    return babel.dates.parse_pattern(PATTERNS.get(format, format)), Locale.parse(locale)
+
+
+def to_datetime(value):
+    # the aware datetime babel would format for value
+    if isinstance(value, str):
+        value = dateutil.parser.parse(value)
+    elif not isinstance(value, datetime) and isinstance(value, date):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=babel.dates.UTC)
+    return value
+
+
+def zone_key(value):
+    # the part of an aware datetime that formatting sees but == ignores: the
+    # same instant in two zones compares equal, so it is part of the cache key
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.tzinfo, value.utcoffset()
+    return None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _format(value, zone, format, locale):
+    if format in BABEL_FORMATS:
+        return babel.dates.format_datetime(to_datetime(value), format, locale=locale)
+    pattern, parsedLocale = compiled(format, locale)
+    return pattern.apply(to_datetime(value), parsedLocale)
+
+
+def format_datetime(value, format='medium', locale='en'):
+    # one date (datetime, date or ISO string) in a named format or pattern
+    return _format(value, zone_key(value), format, locale)
+
+
+def format_datetimes(values, format='medium', locale='en'):
+    # a list of dates in one format, e.g. every show time on a page
+    return [_format(value, zone_key(value), format, locale) for value in values]
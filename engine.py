@@ -0,0 +1,113 @@
+# Imports
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+#----------------------------------------------------------------------------#
+# Database engine.
+#
+# Builds SQLALCHEMY_ENGINE_OPTIONS from the DB_* config values and times
+# every pool checkout, so pool waits and saturation can be watched
+# (/pool/stats) and tuned without editing code.
+#----------------------------------------------------------------------------#
+
+# upper bounds (seconds) of the checkout wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PoolStats(object):
+    # checkout wait times and timeouts, for all TimedQueuePools in the process
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+            self.buckets = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            if timed_out:
+                self.timeouts += 1
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[i] += 1
+                    break
+            else:
+                self.buckets[-1] += 1
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited for a connection
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            pool_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - started)
+        return connection
+
+
+def engine_options(config):
+    # SQLALCHEMY_ENGINE_OPTIONS for config's database URL and DB_* settings
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # one shared in-memory database; a real pool would open empty ones
+            return options
+        # file databases are shared between the pool's connections and threads
+        options['connect_args'] = {'check_same_thread': False}
+    elif url.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': '-c statement_timeout={:d}'.format(config['DB_STATEMENT_TIMEOUT_MS'])}
+    options.update({
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    })
+    return options
+
+
+def pool_status(engine):
+    # the engine pool's current use plus the process-wide checkout waits
+    pool = engine.pool
+    status = {
+        'pool': type(pool).__name__,
+        'checkouts': pool_stats.checkouts,
+        'timeouts': pool_stats.timeouts,
+        'wait_seconds_total': round(pool_stats.wait_seconds, 6),
+        'wait_seconds_max': round(pool_stats.max_wait_seconds, 6),
+        'wait_seconds_avg': round(pool_stats.wait_seconds / pool_stats.checkouts, 6) if pool_stats.checkouts else 0.0,
+        'wait_buckets': dict(zip([str(bound) for bound in WAIT_BUCKETS] + ['+Inf'], pool_stats.buckets)),
+    }
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        status.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'saturation': round(pool.checkedout() / capacity, 4) if capacity else 0.0,
+        })
+    return status
@@ -0,0 +1,52 @@
+# Imports
+import csv
+import io
+import json
+
+from queries import COLUMNS, catalog_query
+
+#----------------------------------------------------------------------------#
+# Bulk export.
+#
+# Full-catalog dumps as CSV or JSON Lines. Each export is one query read
+# through a server-side cursor (yield_per) and encoded a row at a time, so
+# the whole table is never held in memory. Shows carry their artist and
+# venue names from the same joined query (see queries.py).
+#----------------------------------------------------------------------------#
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+EXPORTS = tuple(COLUMNS)
+
+
+def encode(value):
+    # datetimes as ISO 8601, everything else as is
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def iter_export(kind, format, batch_size=1000):
+    # yield the export as text chunks, one per row (plus the CSV header)
+    query = catalog_query(kind)
+    columns = [column['name'] for column in query.column_descriptions]
+    rows = query.yield_per(batch_size)
+
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def line(values):
+            writer.writerow(values)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        yield line(columns)
+        for row in rows:
+            yield line([encode(value) for value in row])
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, map(encode, row)))) + '\n'
@@ -4,10 +4,18 @@ from fabric.contrib.console import confirm
 # prepare for deployment
 
 
+# the repo has no test suite; a small run of the route benchmark drives every
+# read route against a throwaway SQLite database and fails on any 5xx
+SMOKE_TEST = (
+    "python benchmarks/routes.py --database sqlite:////tmp/fyyur-smoke.db"
+    " --venues 50 --artists 100 --shows 1000 --requests 3 --warmup 1"
+)
+
+
 def test():
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m compileall -q . && " + SMOKE_TEST, capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
@@ -39,9 +47,7 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    local("heroku run " + SMOKE_TEST)
 
 
 def deploy():
@@ -1,8 +1,9 @@
 from datetime import datetime
 from wsgiref.validate import validator
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, ValidationError
-from wtforms.validators import DataRequired, AnyOf, URL, Optional
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField, TextAreaField, ValidationError
+from wtforms.validators import DataRequired, InputRequired, AnyOf, URL, Optional, NumberRange
+import config
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -16,6 +17,42 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # minutes; empty means the default show length (see models.DEFAULT_SHOW_DURATION)
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)]
+    )
+
+# many shows for one artist in one go: a tour (one "venue_id, start time" per
+# line in dates) and/or a weekly residency (venue_id + start_time, repeated)
+class ShowBatchForm(Form):
+    artist_id = IntegerField(
+        'artist_id', validators=[InputRequired()]
+    )
+    dates = TextAreaField(
+        'dates'
+    )
+    venue_id = IntegerField(
+        'venue_id',
+        validators=[Optional()]
+    )
+    start_time = DateTimeField(
+        'start_time',
+        validators=[Optional()]
+    )
+    repeat = IntegerField(
+        'repeat',
+        validators=[Optional(), NumberRange(min=1, max=config.SHOW_BATCH_MAX)]
+    )
+    every = IntegerField(
+        'every',
+        validators=[Optional(), NumberRange(min=1, max=52)],
+        default=1
+    )
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)]
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -0,0 +1,276 @@
+# Imports
+import csv
+import json
+import time
+from datetime import datetime, timedelta
+
+from werkzeug.datastructures import MultiDict
+
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show, Genre, count_shows, bump_versions, DEFAULT_SHOW_DURATION
+from schedule import find_conflicts
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#
+# Streams venues, artists or shows from CSV or JSON Lines one row at a time,
+# validates every row with the same form the web UI uses, and inserts the
+# accepted rows a batch per transaction. Memory stays constant in file size.
+#
+# Columns are the form field names (name, city, state, genres,
+# seeking_talent, ...). genres is a list in JSON or comma-separated in CSV.
+# Shows name their artist and venue by artist_id/venue_id or by
+# artist_name/venue_name, and may give a duration in minutes; double
+# bookings are rejected like in the form.
+#----------------------------------------------------------------------------#
+
+FORMS = {
+    'venues': VenueForm,
+    'artists': ArtistForm,
+    'shows': ShowForm,
+}
+
+BOOLEAN_FIELDS = ('seeking_talent', 'seeking_venue')
+FALSE_VALUES = ('', '0', 'false', 'no', 'n', 'off')
+
+
+def read_rows(path, format=None):
+    # yield (line number, row dict or None, error or None), one row at a time
+    format = format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    with open(path, newline='', encoding='utf-8') as f:
+        if format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row, None
+        else:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield number, None, 'invalid JSON: {}'.format(e)
+                    continue
+                if not isinstance(row, dict):
+                    yield number, None, 'expected a JSON object'
+                    continue
+                yield number, row, None
+
+
+def to_formdata(row):
+    # row values -> the MultiDict a browser form post would produce
+    data = MultiDict()
+    for key, value in row.items():
+        if value is None:
+            continue
+        if key == 'genres':
+            values = value if isinstance(value, list) else str(value).split(',')
+            for genre in values:
+                if str(genre).strip():
+                    data.add('genres', str(genre).strip())
+        elif key in BOOLEAN_FIELDS:
+            if str(value).strip().lower() not in FALSE_VALUES:
+                data.add(key, 'y')
+        else:
+            data.add(key, str(value))
+    return data
+
+
+def validate(kind, row):
+    # (form, None) if the row passes the form's rules, else (None, errors)
+    form = FORMS[kind](to_formdata(row), meta={'csrf': False})
+    if form.validate():
+        return form, None
+    return None, form.errors
+
+
+class Importer(object):
+
+    def __init__(self, kind, batch_size=1000, on_reject=None, on_batch=None, cache=None):
+        self.kind = kind
+        self.batch_size = batch_size
+        self.on_reject = on_reject or (lambda number, row, errors: None)
+        self.on_batch = on_batch or (lambda stats: None)
+        self.cache = cache
+        self.stats = {'kind': kind, 'read': 0, 'imported': 0, 'rejected': 0, 'seconds': 0.0}
+        self._genres = None
+        self._rejected = set()    # lines rejected in the current batch
+
+    def run(self, rows):
+        started = time.perf_counter()
+        batch = []
+        for number, row, error in rows:
+            self.stats['read'] += 1
+            if error:
+                self.reject(number, row, {'row': [error]})
+                continue
+            form, errors = validate(self.kind, row)
+            if errors:
+                self.reject(number, row, errors)
+                continue
+            batch.append((number, row, form))
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+                self.stats['seconds'] = time.perf_counter() - started
+                self.on_batch(self.stats)
+        if batch:
+            self.flush(batch)
+        self.stats['seconds'] = time.perf_counter() - started
+        return self.stats
+
+    def reject(self, number, row, errors):
+        self.stats['rejected'] += 1
+        self._rejected.add(number)
+        self.on_reject(number, row, errors)
+
+    def flush(self, batch):
+        # insert one batch in one transaction; a database error rejects the
+        # rows of the batch that weren't already rejected (bad ids, conflicts)
+        self._rejected = set()
+        try:
+            inserted = getattr(self, 'insert_' + self.kind)(batch)
+            db.session.commit()
+            self.stats['imported'] += inserted
+        except Exception as e:
+            db.session.rollback()
+            for number, row, form in batch:
+                if number in self._rejected:
+                    continue
+                self.reject(number, row, {'database': [str(e).splitlines()[0]]})
+
+    def genre_list(self, names):
+        # Genre rows for names, loaded once per import
+        if self._genres is None:
+            self._genres = {genre.name: genre for genre in Genre.query}
+        for name in names:
+            if name not in self._genres:
+                self._genres[name] = Genre(name=name)
+                db.session.add(self._genres[name])
+        return [self._genres[name] for name in names]
+
+    def insert_venues(self, batch):
+        venues = [Venue(
+            name=form.name.data,
+            city=form.city.data,
+            state=form.state.data,
+            address=form.address.data,
+            phone=form.phone.data,
+            genres=",".join(form.genres.data),
+            genre_list=self.genre_list(form.genres.data),
+            facebook_link=form.facebook_link.data,
+            image_link=form.image_link.data,
+            website_link=form.website_link.data,
+            looking_for_talent=form.seeking_talent.data,
+            description=form.seeking_description.data
+        ) for number, row, form in batch]
+        db.session.add_all(venues)
+        db.session.flush()
+        return len(venues)
+
+    def insert_artists(self, batch):
+        artists = [Artist(
+            name=form.name.data,
+            city=form.city.data,
+            state=form.state.data,
+            phone=form.phone.data,
+            genres=",".join(form.genres.data),
+            genre_list=self.genre_list(form.genres.data),
+            facebook_link=form.facebook_link.data,
+            image_link=form.image_link.data,
+            website_link=form.website_link.data,
+            looking_for_venues=form.seeking_venue.data,
+            description=form.seeking_description.data
+        ) for number, row, form in batch]
+        db.session.add_all(artists)
+        db.session.flush()
+        return len(artists)
+
+    def insert_shows(self, batch):
+        artistIds = self.resolve(Artist, batch, 'artist')
+        venueIds = self.resolve(Venue, batch, 'venue')
+
+        now = datetime.now()
+        rows = []
+        for number, row, form in batch:
+            artist_id, artistError = artistIds[number]
+            venue_id, venueError = venueIds[number]
+            if artistError or venueError:
+                self.reject(number, row, {key: [error] for key, error in (('artist', artistError), ('venue', venueError)) if error})
+                continue
+            start_time = form.start_time.data
+            rows.append({
+                'artist_id': artist_id,
+                'venue_id': venue_id,
+                'start_time': start_time,
+                'end_time': start_time + (timedelta(minutes=form.duration.data) if form.duration.data else DEFAULT_SHOW_DURATION),
+                'counted_as_past': start_time <= now,
+                'updated_at': datetime.utcnow(),
+                'line': number,
+                'row': row
+            })
+
+        # double bookings, against the database and within the file
+        conflicts = find_conflicts([(row['venue_id'], row['artist_id'], row['start_time'], row['end_time']) for row in rows])
+        for position in sorted(conflicts):
+            self.reject(rows[position]['line'], rows[position]['row'], {'start_time': [conflicts[position]]})
+        rows = [row for position, row in enumerate(rows) if position not in conflicts]
+        if not rows:
+            return 0
+        for row in rows:
+            del row['line'], row['row']
+
+        # one executemany for the batch, plus the counters in the same transaction
+        db.session.execute(Show.__table__.insert(), rows)
+        count_shows([(row['venue_id'], row['artist_id'], row['counted_as_past']) for row in rows])
+        bump_versions(db.session.connection(), [Show.__tablename__])
+        if self.cache is not None:
+            keys = {'venue:{}'.format(row['venue_id']) for row in rows} | {'artist:{}'.format(row['artist_id']) for row in rows}
+            self.cache.delete(*keys)
+        return len(rows)
+
+    def resolve(self, model, batch, prefix):
+        # {line: (id, error)} for <prefix>_id or <prefix>_name in each row,
+        # checked with one query per batch for ids and one for names
+        idKey = prefix + '_id'
+        nameKey = prefix + '_name'
+        wantedIds = set()
+        wantedNames = set()
+        for number, row, form in batch:
+            if str(row.get(idKey) or '').strip():
+                try:
+                    wantedIds.add(int(row[idKey]))
+                except ValueError:
+                    pass
+            elif row.get(nameKey):
+                wantedNames.add(row[nameKey])
+
+        existing = set()
+        if wantedIds:
+            existing = {id for (id,) in db.session.query(model.id).filter(model.id.in_(wantedIds))}
+        byName = {}
+        if wantedNames:
+            for id, name in db.session.query(model.id, model.name).filter(model.name.in_(wantedNames)):
+                byName.setdefault(name, []).append(id)
+
+        resolved = {}
+        for number, row, form in batch:
+            value = str(row.get(idKey) or '').strip()
+            if value:
+                try:
+                    id = int(value)
+                except ValueError:
+                    resolved[number] = (None, '{} is not an id'.format(value))
+                    continue
+                resolved[number] = (id, None) if id in existing else (None, 'no {} with id {}'.format(prefix, id))
+            elif row.get(nameKey):
+                ids = byName.get(row[nameKey], [])
+                if len(ids) == 1:
+                    resolved[number] = (ids[0], None)
+                elif ids:
+                    resolved[number] = (None, '{} name {!r} is ambiguous'.format(prefix, row[nameKey]))
+                else:
+                    resolved[number] = (None, 'no {} named {!r}'.format(prefix, row[nameKey]))
+            else:
+                resolved[number] = (None, '{} or {} is required'.format(idKey, nameKey))
+        return resolved
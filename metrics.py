@@ -0,0 +1,192 @@
+# Imports
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from engine import WAIT_BUCKETS, pool_stats, pool_status
+
+#----------------------------------------------------------------------------#
+# Request metrics.
+#
+# Every request records its latency per route, and the number and total
+# time of the SQL statements it ran (counted by engine events, on the
+# primary and the replicas alike). Requests over QUERY_BUDGET statements are
+# logged and counted, so N+1 regressions show up in production. /metrics
+# renders the numbers in the Prometheus text format; they are per worker
+# process. asgi.py counts its async pages the same way, through
+# async_request instead of g.
+#----------------------------------------------------------------------------#
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+log = logging.getLogger(__name__)
+
+# [statements, seconds] of the ASGI request running in this context, if any
+async_request = ContextVar('async_request', default=None)
+
+
+class Histogram(object):
+    # cumulative-bucket histogram per label set
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}    # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self, name, label_names):
+        lines = []
+        for labels, series in sorted(self.series.items()):
+            base = ','.join('{}="{}"'.format(key, escape(value)) for key, value in zip(label_names, labels))
+            prefix = base + ',' if base else ''
+            for bound, count in zip(self.buckets, series):
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, prefix, bound, count))
+            lines.append('{}_bucket{{{}le="+Inf"}} {}'.format(name, prefix, series[-2]))
+            lines.append('{}_sum{{{}}} {}'.format(name, base, round(series[-1], 6)))
+            lines.append('{}_count{{{}}} {}'.format(name, base, series[-2]))
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_time = Histogram(LATENCY_BUCKETS)
+        self.over_budget = {}   # endpoint -> count
+
+    def record(self, endpoint, method, status, seconds, queries, db_seconds, over_budget):
+        with self._lock:
+            self.latency.observe((endpoint, method, str(status)), seconds)
+            self.queries.observe((endpoint,), queries)
+            self.db_time.observe((endpoint,), db_seconds)
+            if over_budget:
+                self.over_budget[endpoint] = self.over_budget.get(endpoint, 0) + 1
+
+    def render(self, extra=()):
+        # Prometheus text exposition format
+        with self._lock:
+            lines = [
+                '# HELP fyyur_request_duration_seconds Request latency by route.',
+                '# TYPE fyyur_request_duration_seconds histogram',
+            ]
+            lines += self.latency.render('fyyur_request_duration_seconds', ('endpoint', 'method', 'status'))
+            lines += [
+                '# HELP fyyur_request_queries SQL statements per request.',
+                '# TYPE fyyur_request_queries histogram',
+            ]
+            lines += self.queries.render('fyyur_request_queries', ('endpoint',))
+            lines += [
+                '# HELP fyyur_request_db_seconds Time spent in SQL statements per request.',
+                '# TYPE fyyur_request_db_seconds histogram',
+            ]
+            lines += self.db_time.render('fyyur_request_db_seconds', ('endpoint',))
+            lines += [
+                '# HELP fyyur_requests_over_query_budget_total Requests that ran more than QUERY_BUDGET statements.',
+                '# TYPE fyyur_requests_over_query_budget_total counter',
+            ]
+            lines += ['fyyur_requests_over_query_budget_total{{endpoint="{}"}} {}'.format(escape(endpoint), count)
+                      for endpoint, count in sorted(self.over_budget.items())]
+        for name, kind, help, samples in extra:
+            lines += ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind)]
+            lines += ['{} {}'.format(sample, value) for sample, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def pool_metrics(engine):
+    # the primary pool's state and the checkout wait histogram (engine.py
+    # keeps per-bucket counts; Prometheus buckets are cumulative)
+    status = pool_status(engine)
+    extra = []
+    if 'checked_out' in status:
+        extra += [
+            ('fyyur_db_pool_checked_out', 'gauge', 'Connections checked out of the pool.',
+             [('fyyur_db_pool_checked_out', status['checked_out'])]),
+            ('fyyur_db_pool_saturation', 'gauge', 'Checked out connections over pool capacity.',
+             [('fyyur_db_pool_saturation', status['saturation'])]),
+        ]
+    buckets = []
+    total = 0
+    for bound, count in zip([str(bound) for bound in WAIT_BUCKETS] + ['+Inf'], pool_stats.buckets):
+        total += count
+        buckets.append(('fyyur_db_pool_wait_seconds_bucket{{le="{}"}}'.format(bound), total))
+    extra += [
+        ('fyyur_db_pool_wait_seconds', 'histogram', 'Time spent waiting for a pool connection.',
+         buckets + [('fyyur_db_pool_wait_seconds_sum', round(pool_stats.wait_seconds, 6)),
+                    ('fyyur_db_pool_wait_seconds_count', pool_stats.checkouts)]),
+        ('fyyur_db_pool_timeouts_total', 'counter', 'Pool checkouts that timed out.',
+         [('fyyur_db_pool_timeouts_total', pool_stats.timeouts)]),
+    ]
+    return extra
+
+#----------------------------------------------------------------------------#
+# Hooks.
+#----------------------------------------------------------------------------#
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_started'].pop()
+    if has_app_context() and 'request_queries' in g:
+        g.request_queries += 1
+        g.request_db_seconds += seconds
+    else:
+        counts = async_request.get()
+        if counts is not None:
+            counts[0] += 1
+            counts[1] += seconds
+
+
+def start_request():
+    # before_request
+    g.request_started = time.perf_counter()
+    g.request_queries = 0
+    g.request_db_seconds = 0.0
+
+
+def finish_request(response):
+    # after_request: record the request and flag it if it went over budget
+    if 'request_started' not in g:
+        return response
+    response.headers.add('Server-Timing', record_request(
+        current_app.config, request.endpoint, request.method, request.full_path, response.status_code,
+        time.perf_counter() - g.request_started, g.request_queries, g.request_db_seconds))
+    return response
+
+
+def record_request(config, endpoint, method, full_path, status, seconds, queries, db_seconds):
+    # record a finished request, flag it if it went over budget and return
+    # its Server-Timing header
+    budget = config['QUERY_BUDGET']
+    overBudget = budget is not None and queries > budget
+    if overBudget:
+        log.warning('%s %s ran %d SQL statements (budget %d, %.1f ms in the database)',
+                    method, full_path.rstrip('?'), queries, budget, db_seconds * 1000)
+    metrics.record(endpoint or 'unmatched', method, status, seconds, queries, db_seconds, overBudget)
+    return 'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(db_seconds * 1000, queries, seconds * 1000)
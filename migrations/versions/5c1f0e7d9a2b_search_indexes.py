@@ -0,0 +1,69 @@
+"""search indexes
+
+Revision ID: 5c1f0e7d9a2b
+Revises: 41a0c91deac2
+Create Date: 2026-10-18 10:12:40.114263
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1f0e7d9a2b'
+down_revision = '41a0c91deac2'
+branch_labels = None
+depends_on = None
+
+
+# must stay identical to PostgresSearchBackend.VECTOR in search.py,
+# otherwise the planner won't match the index to the search query
+VECTOR = (
+    "to_tsvector('simple'::regconfig, coalesce(name, '') || ' ' || coalesce(city, '') || ' ' || "
+    "coalesce(state, '') || ' ' || coalesce(genres, ''))"
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in ('venues', 'artists'):
+            op.execute('CREATE INDEX ix_{0}_search_vector ON {0} USING gin ({1})'.format(table, VECTOR))
+            op.execute('CREATE INDEX ix_{0}_name_trgm ON {0} USING gin (lower(name) gin_trgm_ops)'.format(table))
+    elif bind.dialect.name == 'sqlite':
+        for table in ('venues', 'artists'):
+            op.execute(
+                "CREATE VIRTUAL TABLE {0}_fts USING fts5(name, city, state, genres, content='{0}', "
+                "content_rowid='id', tokenize='unicode61 remove_diacritics 2')".format(table)
+            )
+            op.execute(
+                'CREATE TRIGGER {0}_fts_insert AFTER INSERT ON {0} BEGIN '
+                'INSERT INTO {0}_fts(rowid, name, city, state, genres) '
+                'VALUES (new.id, new.name, new.city, new.state, new.genres); END'.format(table)
+            )
+            op.execute(
+                'CREATE TRIGGER {0}_fts_delete AFTER DELETE ON {0} BEGIN '
+                'INSERT INTO {0}_fts({0}_fts, rowid, name, city, state, genres) '
+                "VALUES ('delete', old.id, old.name, old.city, old.state, old.genres); END".format(table)
+            )
+            op.execute(
+                'CREATE TRIGGER {0}_fts_update AFTER UPDATE ON {0} BEGIN '
+                'INSERT INTO {0}_fts({0}_fts, rowid, name, city, state, genres) '
+                "VALUES ('delete', old.id, old.name, old.city, old.state, old.genres); "
+                'INSERT INTO {0}_fts(rowid, name, city, state, genres) '
+                'VALUES (new.id, new.name, new.city, new.state, new.genres); END'.format(table)
+            )
+            op.execute("INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild')".format(table))
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        for table in ('venues', 'artists'):
+            op.execute('DROP INDEX IF EXISTS ix_{0}_name_trgm'.format(table))
+            op.execute('DROP INDEX IF EXISTS ix_{0}_search_vector'.format(table))
+    elif bind.dialect.name == 'sqlite':
+        for table in ('venues', 'artists'):
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute('DROP TRIGGER IF EXISTS {0}_fts_{1}'.format(table, trigger))
+            op.execute('DROP TABLE IF EXISTS {0}_fts'.format(table))
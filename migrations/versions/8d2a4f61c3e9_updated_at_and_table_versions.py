@@ -0,0 +1,39 @@
+"""updated_at columns and table versions
+
+Revision ID: 8d2a4f61c3e9
+Revises: 5c1f0e7d9a2b
+Create Date: 2026-10-18 11:02:17.530914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2a4f61c3e9'
+down_revision = '5c1f0e7d9a2b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute('UPDATE "{}" SET updated_at = CURRENT_TIMESTAMP'.format(table))
+
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute(table_versions.insert().values([
+        {'name': table, 'version': 1, 'updated_at': sa.func.current_timestamp()}
+        for table in ('venues', 'artists', 'Show')
+    ]))
+
+
+def downgrade():
+    op.drop_table('table_versions')
+    for table in ('Show', 'artists', 'venues'):
+        op.drop_column(table, 'updated_at')
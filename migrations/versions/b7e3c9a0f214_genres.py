@@ -0,0 +1,79 @@
+"""genres
+
+Revision ID: b7e3c9a0f214
+Revises: 8d2a4f61c3e9
+Create Date: 2026-10-18 11:48:03.208117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3c9a0f214'
+down_revision = '8d2a4f61c3e9'
+branch_labels = None
+depends_on = None
+
+
+def split_genres(value):
+    # "Jazz,Rock n Roll" -> ['Jazz', 'Rock n Roll']. Also undoes the
+    # '{Jazz,"Rock n Roll"}' form the old edit handlers could store.
+    value = (value or '').strip().strip('{}')
+    names = [name.strip().strip('"').strip() for name in value.split(',')]
+    return [name for name in dict.fromkeys(names) if name]
+
+
+def upgrade():
+    genres = op.create_table('genres',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    venue_genres = op.create_table('venue_genres',
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('genre_id', 'venue_id')
+    )
+    op.create_index(op.f('ix_venue_genres_venue_id'), 'venue_genres', ['venue_id'], unique=False)
+    artist_genres = op.create_table('artist_genres',
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('genre_id', 'artist_id')
+    )
+    op.create_index(op.f('ix_artist_genres_artist_id'), 'artist_genres', ['artist_id'], unique=False)
+
+    # backfill from the comma-joined genres columns
+    bind = op.get_bind()
+    venues = [(id, split_genres(value)) for id, value in bind.execute(sa.text('SELECT id, genres FROM venues'))]
+    artists = [(id, split_genres(value)) for id, value in bind.execute(sa.text('SELECT id, genres FROM artists'))]
+
+    names = sorted({name for _, values in venues + artists for name in values})
+    if names:
+        op.bulk_insert(genres, [{'name': name} for name in names])
+    genreIds = {name: id for id, name in bind.execute(sa.text('SELECT id, name FROM genres'))}
+
+    rows = [{'genre_id': genreIds[name], 'venue_id': id} for id, values in venues for name in values]
+    if rows:
+        op.bulk_insert(venue_genres, rows)
+    rows = [{'genre_id': genreIds[name], 'artist_id': id} for id, values in artists for name in values]
+    if rows:
+        op.bulk_insert(artist_genres, rows)
+
+    # rewrite the display column in the canonical comma-joined form
+    for table, values in (('venues', venues), ('artists', artists)):
+        for id, names in values:
+            bind.execute(sa.text('UPDATE {} SET genres = :genres WHERE id = :id'.format(table)), {'genres': ','.join(names), 'id': id})
+
+
+def downgrade():
+    op.drop_index(op.f('ix_artist_genres_artist_id'), table_name='artist_genres')
+    op.drop_table('artist_genres')
+    op.drop_index(op.f('ix_venue_genres_venue_id'), table_name='venue_genres')
+    op.drop_table('venue_genres')
+    op.drop_table('genres')
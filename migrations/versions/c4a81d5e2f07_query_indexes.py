@@ -0,0 +1,34 @@
+"""query indexes
+
+Revision ID: c4a81d5e2f07
+Revises: b7e3c9a0f214
+Create Date: 2026-10-18 12:30:55.871402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a81d5e2f07'
+down_revision = 'b7e3c9a0f214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_venues_state_city', 'venues', ['state', 'city'], unique=False)
+    op.create_index('ix_artists_name_id', 'artists', ['name', 'id'], unique=False)
+    op.create_index('ix_venues_lower_name', 'venues', [sa.text('lower(name)')], unique=False)
+    op.create_index('ix_artists_lower_name', 'artists', [sa.text('lower(name)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_lower_name', table_name='artists')
+    op.drop_index('ix_venues_lower_name', table_name='venues')
+    op.drop_index('ix_artists_name_id', table_name='artists')
+    op.drop_index('ix_venues_state_city', table_name='venues')
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
@@ -0,0 +1,42 @@
+"""show counters
+
+Revision ID: d91f3b6a8c25
+Revises: c4a81d5e2f07
+Create Date: 2026-10-18 13:21:44.092716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd91f3b6a8c25'
+down_revision = 'c4a81d5e2f07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('Show', sa.Column('counted_as_past', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.create_index('ix_Show_counted_as_past_start_time', 'Show', ['counted_as_past', 'start_time'], unique=False)
+
+    # backfill: flag the shows that have already started, then count per venue/artist
+    show = sa.table('Show', sa.column('start_time', sa.DateTime), sa.column('counted_as_past', sa.Boolean))
+    op.execute(show.update().where(show.c.start_time <= sa.func.current_timestamp()).values(counted_as_past=True))
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.execute(
+            'UPDATE {0} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{1} = {0}.id AND NOT "Show".counted_as_past), '
+            'past_shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{1} = {0}.id AND "Show".counted_as_past)'.format(table, key)
+        )
+
+
+def downgrade():
+    op.drop_index('ix_Show_counted_as_past_start_time', table_name='Show')
+    op.drop_column('Show', 'counted_as_past')
+    for table in ('artists', 'venues'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
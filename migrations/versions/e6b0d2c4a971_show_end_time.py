@@ -0,0 +1,50 @@
+"""show end time and no double bookings
+
+Revision ID: e6b0d2c4a971
+Revises: d91f3b6a8c25
+Create Date: 2026-10-18 17:40:12.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b0d2c4a971'
+down_revision = 'd91f3b6a8c25'
+branch_labels = None
+depends_on = None
+
+# existing shows get the app's default length (models.DEFAULT_SHOW_DURATION)
+DEFAULT_MINUTES = 120
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    if bind.dialect.name == 'postgresql':
+        op.execute('UPDATE "Show" SET end_time = start_time + interval \'{} minutes\''.format(DEFAULT_MINUTES))
+    else:
+        op.execute('UPDATE "Show" SET end_time = datetime(start_time, \'+{} minutes\')'.format(DEFAULT_MINUTES))
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+    if bind.dialect.name == 'postgresql':
+        # no two shows may overlap at a venue or for an artist, even under
+        # concurrent writers. Fails if the existing data already has overlaps;
+        # resolve those first.
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for column in ('venue_id', 'artist_id'):
+            op.execute(
+                'ALTER TABLE "Show" ADD CONSTRAINT "Show_{0}_no_overlap" '
+                "EXCLUDE USING gist ({0} WITH =, tsrange(start_time, end_time, '[)') WITH &&)".format(column)
+            )
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        for column in ('artist_id', 'venue_id'):
+            op.execute('ALTER TABLE "Show" DROP CONSTRAINT "Show_{}_no_overlap"'.format(column))
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_column('end_time')
@@ -1,11 +1,47 @@
 # Imports
+from collections import Counter
+from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, event
+from sqlalchemy.orm import Session, sessionmaker
 
-db = SQLAlchemy()
+from routing import RoutingSession
+
+# sessions pick the primary or a read replica per request (routing.py)
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        # Flask-SQLAlchemy 2.x: its create_session() hardcodes
+        # class_=SignallingSession, so session_options can't replace it
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+# 3.x has no create_session() and takes the class from session_options
+db = RoutingSQLAlchemy(session_options={} if hasattr(SQLAlchemy, 'create_session') else {'class_': RoutingSession})
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
+class Genre(db.Model):
+    __tablename__ = 'genres'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+
+    def __repr__(self):
+        return f'<Genre ID: {self.id}, name: {self.name}>'
+
+# genre_id leads the primary key so "all venues/artists in a genre" is an
+# index range scan; the second index serves the reverse lookup.
+venue_genres = db.Table('venue_genres',
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('venue_id', db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True, index=True)
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('artist_id', db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True, index=True)
+)
+
 class Venue(db.Model):
     __tablename__ = 'venues'
 
@@ -15,13 +51,17 @@ class Venue(db.Model):
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120)) # < genres = db.Column(db.PickleType, nullable=True) > 
+    genres = db.Column(db.String(120)) # comma-joined copy of genre_list, for display and the search indexes
+    genre_list = db.relationship('Genre', secondary=venue_genres, lazy=True)
     facebook_link = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     website_link = db.Column(db.String(120))
     looking_for_talent = db.Column(db.Boolean, nullable=True, default=False)
     description  = db.Column(db.String(200))
     shows = db.relationship("Show", backref="venues", lazy=True)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f'<Venue ID: {self.id}, name: {self.name}, genres: {self.genres}, city: {self.city}>'
@@ -37,13 +77,17 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120)) # < genres = db.Column(db.PickleType, nullable=True) > 
+    genres = db.Column(db.String(120)) # comma-joined copy of genre_list, for display and the search indexes
+    genre_list = db.relationship('Genre', secondary=artist_genres, lazy=True)
     facebook_link = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     website_link = db.Column(db.String(120))
     looking_for_venues = db.Column(db.Boolean, nullable=True, default=False)
     description  = db.Column(db.String(200))
     shows = db.relationship("Show", backref="artists", lazy=True)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f'<Artist ID: {self.id}, name: {self.name}, show: {self.show}>'
@@ -51,6 +95,14 @@ class Artist(db.Model):
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
     # DONE.
 
+# a show without an explicit end lasts DEFAULT_SHOW_DURATION; none may be
+# longer than MAX_SHOW_DURATION (the overlap checks in schedule.py rely on it)
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+MAX_SHOW_DURATION = timedelta(hours=24)
+
+def _default_end_time(context):
+	return context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 class Show(db.Model):
 	__tablename__ = "Show"
@@ -58,9 +110,143 @@ class Show(db.Model):
 	artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), nullable=False,)
 	venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), nullable=False,)
 	start_time = db.Column(db.DateTime, nullable=False)
+	end_time = db.Column(db.DateTime, nullable=False, default=_default_end_time)
+	# which counter (upcoming/past) this show is currently counted in; flipped by roll_over_shows()
+	counted_as_past = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+	updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 	artist = db.relationship('Artist')
 	venue = db.relationship('Venue')
 
 	def __repr__(self):
-		return f'<Show id: {self.id}, artist_id: {self.artist_id}, venue_id: {self.venue_id}'
\ No newline at end of file
+		return f'<Show id: {self.id}, artist_id: {self.artist_id}, venue_id: {self.venue_id}'
+
+# Indexes for the app's query shapes (migration c4a81d5e2f07):
+# - a venue's/artist's shows by time (detail pages, upcoming counts)
+# - /venues grouped by state and city
+# - /artists?sort=name keyset pages on (name, id)
+# - case-insensitive name lookups
+QUERY_INDEXES = (
+    db.Index('ix_Show_venue_id_start_time', Show.venue_id, Show.start_time),
+    db.Index('ix_Show_artist_id_start_time', Show.artist_id, Show.start_time),
+    db.Index('ix_venues_state_city', Venue.state, Venue.city),
+    db.Index('ix_artists_name_id', Artist.name, Artist.id),
+    db.Index('ix_venues_lower_name', db.func.lower(Venue.name)),
+    db.Index('ix_artists_lower_name', db.func.lower(Artist.name)),
+)
+
+# finds the shows roll_over_shows() still has to move (migration d91f3b6a8c25)
+ix_show_rollover = db.Index('ix_Show_counted_as_past_start_time', Show.counted_as_past, Show.start_time)
+
+def set_genres(instance, names):
+    # point a Venue/Artist at the Genre rows for names (creating missing ones)
+    # and keep its comma-joined genres column in step
+    names = [name for name in dict.fromkeys(names) if name]
+    existing = {genre.name: genre for genre in Genre.query.filter(Genre.name.in_(names))} if names else {}
+    for name in names:
+        if name not in existing:
+            # added to the session so the next lookup (autoflush) finds it
+            existing[name] = Genre(name=name)
+            db.session.add(existing[name])
+    instance.genre_list = [existing[name] for name in names]
+    instance.genres = ",".join(names)
+
+# Per-table version counters, bumped in the same transaction as any write to
+# venues, artists or Show. Read pages derive their ETag/Last-Modified from
+# these rows, so a conditional GET costs one primary-key lookup.
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TableVersion {self.name}: {self.version}>'
+
+VERSIONED_TABLES = (Venue.__tablename__, Artist.__tablename__, Show.__tablename__)
+
+def bump_versions(connection, names):
+    # increment the version of each table name, creating missing rows
+    table = TableVersion.__table__
+    now = datetime.utcnow()
+    for name in names:
+        updated = connection.execute(
+            table.update().where(table.c.name == name).values(version=table.c.version + 1, updated_at=now)
+        )
+        if updated.rowcount == 0:
+            connection.execute(table.insert().values(name=name, version=1, updated_at=now))
+
+def table_versions(names):
+    # {name: (version, updated_at)} for the given table names, in one query
+    rows = db.session.query(TableVersion.name, TableVersion.version, TableVersion.updated_at).filter(
+        TableVersion.name.in_(names)
+    ).all()
+    return {row.name: (row.version, row.updated_at) for row in rows}
+
+@event.listens_for(Session, 'before_flush')
+def _bump_versions_on_flush(session, flush_context, instances):
+    names = set()
+    dirty = [instance for instance in session.dirty if session.is_modified(instance)]
+    for instance in list(session.new) + dirty + list(session.deleted):
+        tablename = getattr(instance, '__tablename__', None)
+        if tablename in VERSIONED_TABLES:
+            names.add(tablename)
+    if names:
+        bump_versions(session.connection(), sorted(names))
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#
+# Venue/Artist.upcoming_shows_count and past_shows_count are kept up to date
+# by the write paths, in the same transaction as the show rows, so list pages
+# can show counts without joining Show.
+#----------------------------------------------------------------------------#
+def count_shows(shows, delta=1):
+    # add (delta=1) or remove (delta=-1) shows from their venue's and artist's
+    # counters. shows is an iterable of (venue_id, artist_id, counted_as_past).
+    venues = Counter()
+    artists = Counter()
+    for venue_id, artist_id, past in shows:
+        venues[(int(venue_id), bool(past))] += delta
+        artists[(int(artist_id), bool(past))] += delta
+
+    changed = []
+    for model, counts in ((Venue, venues), (Artist, artists)):
+        table = model.__table__
+        for past in (False, True):
+            column = table.c.past_shows_count if past else table.c.upcoming_shows_count
+            rows = [{'row_id': id, 'delta': n} for (id, isPast), n in counts.items() if isPast == past and n]
+            if rows:
+                # one executemany per counter column, each an atomic col = col + delta
+                db.session.execute(
+                    table.update().where(table.c.id == bindparam('row_id')).values({column.name: column + bindparam('delta')}),
+                    rows
+                )
+                changed.append(table.name)
+    if changed:
+        bump_versions(db.session.connection(), sorted(set(changed)))
+
+def roll_over_shows(now=None, batch_size=1000):
+    # move shows whose start_time has passed from the upcoming counters to the
+    # past counters, a batch at a time. Each batch is one transaction, and the
+    # counters and the counted_as_past flags move together.
+    # Returns how many shows were moved.
+    now = now or datetime.now()
+    moved = 0
+    while True:
+        due = db.session.query(Show.id, Show.venue_id, Show.artist_id).filter(
+            Show.counted_as_past == False,
+            Show.start_time <= now
+        ).order_by(Show.start_time).limit(batch_size).with_for_update().all()
+        if not due:
+            break
+        count_shows([(venue_id, artist_id, False) for _, venue_id, artist_id in due], -1)
+        count_shows([(venue_id, artist_id, True) for _, venue_id, artist_id in due], 1)
+        db.session.query(Show).filter(Show.id.in_([id for id, _, _ in due])).update(
+            {Show.counted_as_past: True}, synchronize_session=False
+        )
+        bump_versions(db.session.connection(), [Show.__tablename__])
+        db.session.commit()
+        moved += len(due)
+    return moved
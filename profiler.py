@@ -0,0 +1,155 @@
+# Imports
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+
+#----------------------------------------------------------------------------#
+# On-demand request profiler.
+#
+# With PROFILING on, a request that sends an X-Profile header or a ?profile=
+# parameter (equal to PROFILE_TOKEN, when one is set) is profiled on its
+# own and written to PROFILE_DIR: `cprofile` (the default) writes a pstats
+# file, `sample` samples the request thread's stack every
+# PROFILE_SAMPLE_INTERVAL seconds and writes flame-graph-ready collapsed
+# stacks. The response gets Server-Timing entries for the time spent in
+# render_template and the datetime filter (DB time is added by metrics.py)
+# and an X-Profile header naming the file. One request is profiled at a
+# time; others asking meanwhile are served unprofiled.
+#----------------------------------------------------------------------------#
+
+MODES = ('cprofile', 'sample')
+
+# (Server-Timing name, module, function) whose time is reported
+BREAKDOWN = (
+    ('render', 'flask.templating', 'render_template'),
+    ('datetime', 'dates', 'format_datetime'),
+    ('datetime', 'dates', 'format_datetimes'),
+)
+
+log = logging.getLogger(__name__)
+_busy = threading.Lock()
+
+
+def requested_mode():
+    # the profiling mode this request asks for, or None
+    config = current_app.config
+    if not config.get('PROFILING'):
+        return None
+    value = request.headers.get('X-Profile') or request.args.get('profile')
+    if not value:
+        return None
+    mode, _, token = value.partition(':')
+    if mode not in MODES:
+        mode, token = 'cprofile', value
+    if config.get('PROFILE_TOKEN') and token != config['PROFILE_TOKEN']:
+        return None
+    return mode
+
+
+class Sampler(threading.Thread):
+    # samples one thread's Python stack at a fixed interval
+
+    def __init__(self, thread_id, interval):
+        super(Sampler, self).__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                if frame.f_code is finish_profile.__code__:
+                    # the request is over; don't sample the profiler stopping
+                    stack = None
+                    break
+                stack.append('{}:{}'.format(frame.f_globals.get('__name__'), frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def start_profile():
+    # before_request
+    mode = requested_mode()
+    if mode is None or not _busy.acquire(blocking=False):
+        return
+    g.profile_mode = mode
+    g.profile_started = time.perf_counter()
+    if mode == 'cprofile':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+    else:
+        g.profiler = Sampler(threading.get_ident(), current_app.config['PROFILE_SAMPLE_INTERVAL'])
+        g.profiler.start()
+
+
+def finish_profile(response):
+    # after_request: stop the profiler, write its output and report the breakdown
+    if 'profiler' not in g:
+        return response
+    try:
+        if g.profile_mode == 'cprofile':
+            g.profiler.disable()
+        else:
+            g.profiler.stop()
+        seconds = time.perf_counter() - g.profile_started
+        directory = current_app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = '{}-{}-{}'.format(datetime.now().strftime('%Y%m%d-%H%M%S-%f'), request.endpoint or 'unmatched', os.getpid())
+        if g.profile_mode == 'cprofile':
+            path = os.path.join(directory, name + '.prof')
+            g.profiler.dump_stats(path)
+            breakdown = cprofile_breakdown(pstats.Stats(g.profiler))
+        else:
+            path = os.path.join(directory, name + '.collapsed')
+            with open(path, 'w', encoding='utf-8') as output:
+                for stack, count in g.profiler.stacks.most_common():
+                    output.write('{} {}\n'.format(stack, count))
+            breakdown = sample_breakdown(g.profiler.stacks, seconds)
+    finally:
+        del g.profiler
+        _busy.release()
+    for key, spent in breakdown.items():
+        response.headers.add('Server-Timing', '{};dur={:.2f}'.format(key, spent * 1000))
+    response.headers['X-Profile'] = os.path.basename(path)
+    log.info('profiled %s %s in %.1f ms (%s): %s', request.method, request.full_path.rstrip('?'), seconds * 1000,
+             ', '.join('{} {:.1f} ms'.format(key, spent * 1000) for key, spent in breakdown.items()), path)
+    return response
+
+
+def cprofile_breakdown(stats):
+    # cumulative time of each BREAKDOWN function, from cProfile stats
+    breakdown = dict.fromkeys([key for key, _, _ in BREAKDOWN], 0.0)
+    for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items():
+        for key, module, name in BREAKDOWN:
+            if function == name and filename.endswith(os.sep + os.path.join(*module.split('.')) + '.py'):
+                breakdown[key] += cumulative
+    return breakdown
+
+
+def sample_breakdown(stacks, seconds):
+    # wall time of each BREAKDOWN function, estimated as its share of samples
+    total = sum(stacks.values())
+    breakdown = dict.fromkeys([key for key, _, _ in BREAKDOWN], 0.0)
+    if not total:
+        return breakdown
+    for key, module, name in BREAKDOWN:
+        frame = '{}:{}'.format(module, name)
+        hits = sum(count for stack, count in stacks.items() if frame in stack.split(';'))
+        breakdown[key] += seconds * hits / total
+    return breakdown
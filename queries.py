@@ -0,0 +1,91 @@
+# Imports
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Catalog queries.
+#
+# The public columns of venues, artists and shows under their public names,
+# shared by the exports and the JSON API. catalog_query() selects only the
+# fields asked for, and only joins the tables those fields come from.
+#----------------------------------------------------------------------------#
+
+COLUMNS = {
+    'venues': {
+        'id': Venue.id,
+        'name': Venue.name,
+        'city': Venue.city,
+        'state': Venue.state,
+        'address': Venue.address,
+        'phone': Venue.phone,
+        'genres': Venue.genres,
+        'image_link': Venue.image_link,
+        'facebook_link': Venue.facebook_link,
+        'website_link': Venue.website_link,
+        'seeking_talent': Venue.looking_for_talent,
+        'seeking_description': Venue.description,
+        'upcoming_shows_count': Venue.upcoming_shows_count,
+        'past_shows_count': Venue.past_shows_count,
+    },
+    'artists': {
+        'id': Artist.id,
+        'name': Artist.name,
+        'city': Artist.city,
+        'state': Artist.state,
+        'phone': Artist.phone,
+        'genres': Artist.genres,
+        'image_link': Artist.image_link,
+        'facebook_link': Artist.facebook_link,
+        'website_link': Artist.website_link,
+        'seeking_venue': Artist.looking_for_venues,
+        'seeking_description': Artist.description,
+        'upcoming_shows_count': Artist.upcoming_shows_count,
+        'past_shows_count': Artist.past_shows_count,
+    },
+    'shows': {
+        'id': Show.id,
+        'start_time': Show.start_time,
+        'end_time': Show.end_time,
+        'venue_id': Show.venue_id,
+        'venue_name': Venue.name,
+        'artist_id': Show.artist_id,
+        'artist_name': Artist.name,
+        'artist_image_link': Artist.image_link,
+    },
+}
+
+MODELS = {
+    'venues': Venue,
+    'artists': Artist,
+    'shows': Show,
+}
+
+
+def parse_fields(kind, value):
+    # "name,city" -> ['id', 'name', 'city'] (id always comes first, for
+    # cursors and links). Raises ValueError on an unknown field.
+    if not value:
+        return list(COLUMNS[kind])
+    fields = ['id']
+    for name in value.split(','):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in COLUMNS[kind]:
+            raise ValueError('unknown field {!r}'.format(name))
+        fields.append(name)
+    return fields
+
+
+def catalog_query(kind, fields=None):
+    # rows of (field, ...) for kind, in id order
+    model = MODELS[kind]
+    columns = COLUMNS[kind]
+    fields = fields or list(columns)
+    query = db.session.query(*[columns[name].label(name) for name in fields]).select_from(model)
+    if model is Show:
+        tables = {columns[name].class_ for name in fields}
+        if Venue in tables:
+            query = query.join(Venue, Show.venue_id == Venue.id)
+        if Artist in tables:
+            query = query.join(Artist, Show.artist_id == Artist.id)
+    return query.order_by(model.id)
@@ -0,0 +1,77 @@
+# Imports
+import random
+import time
+
+from flask import current_app, g, has_app_context, request, session
+
+try:
+    from flask_sqlalchemy.session import Session as BaseSession
+except ImportError:
+    # Flask-SQLAlchemy 2.x
+    from flask_sqlalchemy import SignallingSession as BaseSession
+
+#----------------------------------------------------------------------------#
+# Read-replica routing.
+#
+# Views marked @read_replica run their queries on one of the replica binds
+# (REPLICA_BINDS, engines from SQLALCHEMY_BINDS); everything else, and any
+# session with pending writes, uses the primary. After a write a client stays
+# on the primary for REPLICA_STICKY_SECONDS so it reads its own writes, and a
+# pending flash message (the page after a write) is always read there too,
+# bypassing the page cache, which another client may have refilled from a
+# lagging replica.
+#----------------------------------------------------------------------------#
+
+STICKY_KEY = '_primary_until'
+
+
+def read_replica(view):
+    # mark a view as read-only, so its queries may go to a replica
+    view.read_replica = True
+    return view
+
+
+def bind_engine(key):
+    # the engine of a SQLALCHEMY_BINDS key, across Flask-SQLAlchemy versions
+    state = current_app.extensions['sqlalchemy']
+    db = getattr(state, 'db', state)
+    engines = getattr(db, 'engines', None)
+    return engines[key] if engines is not None else db.get_engine(current_app, bind=key)
+
+
+class RoutingSession(BaseSession):
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica and not self._flushing and not (self.new or self.dirty or self.deleted):
+            return bind_engine(replica)
+        return super(RoutingSession, self).get_bind(mapper, clause, **kwargs)
+
+
+def choose_bind():
+    # before_request: pick a replica for this request, if it may use one
+    replicas = current_app.config.get('REPLICA_BINDS')
+    if not replicas or request.method not in ('GET', 'HEAD', 'POST'):
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'read_replica', False):
+        return
+    if session.get('_flashes') or session.get(STICKY_KEY, 0) > time.time():
+        g.db_own_writes = True
+        return
+    g.db_replica = random.choice(replicas)
+
+
+def reading_own_writes():
+    # whether this request was kept on the primary to see its client's writes
+    return g.get('db_own_writes', False)
+
+
+def stick_to_primary(response):
+    # after_request: a write keeps this client on the primary for a while
+    if request.method in ('GET', 'HEAD', 'OPTIONS'):
+        return response
+    view = current_app.view_functions.get(request.endpoint)
+    if current_app.config.get('REPLICA_BINDS') and not getattr(view, 'read_replica', False):
+        session[STICKY_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    return response
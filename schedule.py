@@ -0,0 +1,220 @@
+# Imports
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import and_, or_
+
+from models import db, Venue, Artist, Show, MAX_SHOW_DURATION, count_shows, bump_versions
+
+#----------------------------------------------------------------------------#
+# Show scheduling.
+#
+# A show occupies [start_time, end_time) at its venue and for its artist, and
+# no two shows may overlap at the same venue or for the same artist.
+#
+# Because no show is longer than MAX_SHOW_DURATION, every show overlapping
+# [start, end) starts inside [start - MAX_SHOW_DURATION, end). That is a
+# range scan on the (venue_id, start_time) and (artist_id, start_time)
+# indexes, so a conflict check costs O(log n + k) however long the venue's
+# history is. On Postgres the exclusion constraints from migration
+# e6b0d2c4a971 also enforce the rule for concurrent writers.
+#----------------------------------------------------------------------------#
+
+
+class IntervalIndex(object):
+    # in-memory intervals kept sorted by start. With every interval at most
+    # max_length long, overlapping() is a bisect plus a scan of the k
+    # intervals that start inside [start - max_length, end).
+
+    def __init__(self, max_length=MAX_SHOW_DURATION):
+        self.max_length = max_length
+        self._intervals = []    # sorted (start, end, n, item)
+        self._count = 0
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def add(self, start, end, item=None):
+        # n keeps the tuples ordered without comparing items
+        self._count += 1
+        insort(self._intervals, (start, end, self._count, item))
+
+    def overlapping(self, start, end):
+        # items whose interval overlaps [start, end)
+        i = bisect_left(self._intervals, (start - self.max_length,))
+        results = []
+        while i < len(self._intervals) and self._intervals[i][0] < end:
+            if self._intervals[i][1] > start:
+                results.append(self._intervals[i][3])
+            i += 1
+        return results
+
+
+def overlap_conditions(start, end):
+    # Show rows overlapping [start, end), bounded for the start_time indexes
+    return (
+        Show.start_time > start - MAX_SHOW_DURATION,
+        Show.start_time < end,
+        Show.end_time > start
+    )
+
+
+def overlaps(query, start, end):
+    return query.filter(*overlap_conditions(start, end))
+
+
+def find_conflicts(shows):
+    # shows: list of (venue_id, artist_id, start_time, end_time) to be booked.
+    # Returns {position: message} for each one that overlaps an existing show
+    # or an earlier one in the list. One indexed range query for the batch.
+    if not shows:
+        return {}
+    venueIds = {int(venue_id) for venue_id, _, _, _ in shows}
+    artistIds = {int(artist_id) for _, artist_id, _, _ in shows}
+    start = min(show[2] for show in shows)
+    end = max(show[3] for show in shows)
+
+    existing = overlaps(db.session.query(
+        Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time
+    ).filter(
+        or_(Show.venue_id.in_(venueIds), Show.artist_id.in_(artistIds))
+    ), start, end).all()
+
+    indexes = {}
+    def index(key):
+        if key not in indexes:
+            indexes[key] = IntervalIndex()
+        return indexes[key]
+    for show in existing:
+        label = 'show {} ({:%Y-%m-%d %H:%M}-{:%H:%M})'.format(show.id, show.start_time, show.end_time)
+        index(('venue', show.venue_id)).add(show.start_time, show.end_time, label)
+        index(('artist', show.artist_id)).add(show.start_time, show.end_time, label)
+
+    conflicts = {}
+    for position, (venue_id, artist_id, start_time, end_time) in enumerate(shows):
+        keys = (('venue', int(venue_id)), ('artist', int(artist_id)))
+        messages = []
+        for kind, id in keys:
+            for label in index((kind, id)).overlapping(start_time, end_time):
+                messages.append('{} {} is already booked: {}'.format(kind, id, label))
+        if messages:
+            conflicts[position] = '; '.join(messages)
+            continue
+        # later rows in the same batch must not overlap this one either
+        label = 'row {} ({:%Y-%m-%d %H:%M}-{:%H:%M})'.format(position + 1, start_time, end_time)
+        for key in keys:
+            index(key).add(start_time, end_time, label)
+    return conflicts
+
+
+#----------------------------------------------------------------------------#
+# Batch booking.
+#----------------------------------------------------------------------------#
+
+def weekly(start_time, repeat, every=1):
+    # start_time and the repeat - 1 dates every `every` weeks after it
+    return [start_time + timedelta(weeks=every * n) for n in range(repeat)]
+
+
+def book_shows(shows):
+    # insert all of shows (dicts of artist_id, venue_id, start_time, end_time)
+    # or none of them. Returns one result dict per show, in order; a result
+    # with an 'error' means nothing was inserted. The caller commits.
+    venueIds = {show['venue_id'] for show in shows}
+    artistIds = {show['artist_id'] for show in shows}
+    venues = {id for (id,) in db.session.query(Venue.id).filter(Venue.id.in_(venueIds))}
+    artists = {id for (id,) in db.session.query(Artist.id).filter(Artist.id.in_(artistIds))}
+    conflicts = find_conflicts([
+        (show['venue_id'], show['artist_id'], show['start_time'], show['end_time']) for show in shows
+    ])
+
+    results = []
+    for position, show in enumerate(shows):
+        result = dict(show)
+        if show['venue_id'] not in venues:
+            result['error'] = 'no venue with id {}'.format(show['venue_id'])
+        elif show['artist_id'] not in artists:
+            result['error'] = 'no artist with id {}'.format(show['artist_id'])
+        elif position in conflicts:
+            result['error'] = conflicts[position]
+        results.append(result)
+    if any('error' in result for result in results):
+        return results
+
+    # every row in one executemany, counters in the same transaction
+    now = datetime.now()
+    rows = [dict(show, counted_as_past=show['start_time'] <= now, updated_at=datetime.utcnow()) for show in shows]
+    db.session.execute(Show.__table__.insert(), rows)
+    count_shows([(row['venue_id'], row['artist_id'], row['counted_as_past']) for row in rows])
+    bump_versions(db.session.connection(), [Show.__tablename__])
+    return results
+
+
+# the exclusion constraints of migration e6b0d2c4a971
+OVERLAP_CONSTRAINTS = ('Show_venue_id_no_overlap', 'Show_artist_id_no_overlap')
+
+
+def is_overlap_violation(error):
+    # whether an IntegrityError is Postgres refusing an overlapping show (a
+    # concurrent double booking), rather than e.g. a foreign key violation
+    orig = getattr(error, 'orig', None)
+    if getattr(orig, 'pgcode', None) != '23P01':
+        return False
+    return getattr(getattr(orig, 'diag', None), 'constraint_name', None) in OVERLAP_CONSTRAINTS
+
+
+#----------------------------------------------------------------------------#
+# Availability.
+#
+# Free time is what the shows in a window leave over: one indexed range query
+# for the shows, sorted by start_time, then a single sweep over them.
+#----------------------------------------------------------------------------#
+
+def free_slots(busy, start, end, min_length=timedelta(0)):
+    # busy: (start, end) intervals sorted by start. Returns the gaps in
+    # [start, end) that are at least min_length long, as (start, end).
+    slots = []
+    cursor = start
+    for busyStart, busyEnd in busy:
+        if busyStart > cursor:
+            gapEnd = min(busyStart, end)
+            if gapEnd - cursor >= min_length:
+                slots.append((cursor, gapEnd))
+        cursor = max(cursor, busyEnd)
+        if cursor >= end:
+            break
+    if cursor < end and end - cursor >= min_length:
+        slots.append((cursor, end))
+    return slots
+
+
+def busy_times(column, id, start, end):
+    # (start_time, end_time) of the shows of one venue/artist in the window
+    return overlaps(db.session.query(Show.start_time, Show.end_time).filter(
+        column == id
+    ), start, end).order_by(Show.start_time).all()
+
+
+def venues_availability(start, end, min_length=timedelta(0), city=None, state=None):
+    # [(venue id, name, free slots)] for the venues in city/state that have
+    # at least one free slot, from one query: the venues outer-joined to
+    # their shows in the window.
+    query = db.session.query(
+        Venue.id, Venue.name, Show.start_time, Show.end_time
+    ).outerjoin(
+        Show, and_(Show.venue_id == Venue.id, *overlap_conditions(start, end))
+    )
+    if city:
+        query = query.filter(Venue.city == city)
+    if state:
+        query = query.filter(Venue.state == state)
+
+    results = []
+    rows = query.order_by(Venue.id, Show.start_time)
+    for (id, name), shows in groupby(rows, key=lambda row: (row.id, row.name)):
+        busy = [(row.start_time, row.end_time) for row in shows if row.start_time is not None]
+        slots = free_slots(busy, start, end, min_length)
+        if slots:
+            results.append((id, name, slots))
+    return results
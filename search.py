@@ -0,0 +1,188 @@
+# Imports
+import re
+
+from sqlalchemy import text
+
+#----------------------------------------------------------------------------#
+# Search backends.
+#
+# Venue and artist search goes through one of these instead of
+# name.ilike('%term%'), which can't use an index. Every backend answers
+# search(table, term, limit) with (id, name) rows, best match first, and
+# matches the term against name, city, state and genres.
+#----------------------------------------------------------------------------#
+
+# tables that can be searched and the columns that are indexed for them
+SEARCH_TABLES = ('venues', 'artists')
+SEARCH_COLUMNS = ('name', 'city', 'state', 'genres')
+
+
+def tokenize(term):
+    # lowercase words only, so user input never reaches a query parser raw
+    return re.findall(r'\w+', term.lower())
+
+
+def contains_pattern(term):
+    # a LIKE pattern (escaped with backslashes) matching term anywhere
+    return '%{}%'.format(term.strip().lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+
+
+class SearchBackend(object):
+    name = None
+
+    def __init__(self, db):
+        self.db = db
+
+    def install(self):
+        # create whatever indexes/tables the backend needs. Must be idempotent.
+        pass
+
+    def search(self, table, term, limit):
+        raise NotImplementedError
+
+    def browse(self, table, limit):
+        # an empty search lists everything, alphabetically
+        return self.db.session.execute(
+            text('SELECT id, name FROM {} ORDER BY name, id LIMIT :limit'.format(table)),
+            {'limit': limit}
+        ).fetchall()
+
+
+class LikeSearchBackend(SearchBackend):
+    # the original behaviour: a sequential scan with ILIKE. Kept for
+    # databases that don't have the search indexes installed.
+    name = 'like'
+
+    def search(self, table, term, limit):
+        if not term.strip():
+            return self.browse(table, limit)
+        pattern = contains_pattern(term)
+        conditions = ' OR '.join(
+            "lower(coalesce({}, '')) LIKE :pattern ESCAPE '\\'".format(column) for column in SEARCH_COLUMNS
+        )
+        return self.db.session.execute(
+            text('SELECT id, name FROM {} WHERE {} ORDER BY name, id LIMIT :limit'.format(table, conditions)),
+            {'pattern': pattern, 'limit': limit}
+        ).fetchall()
+
+
+class PostgresSearchBackend(SearchBackend):
+    # tsvector over name, city, state and genres for word/prefix matches,
+    # plus a pg_trgm index on lower(name) so substring matches on the name
+    # still come from an index. Both indexes are created by migration
+    # 5c1f0e7d9a2b; the expressions below must stay identical to it.
+    name = 'postgresql'
+
+    VECTOR = (
+        "to_tsvector('simple'::regconfig, coalesce(name, '') || ' ' || coalesce(city, '') || ' ' || "
+        "coalesce(state, '') || ' ' || coalesce(genres, ''))"
+    )
+
+    def install(self):
+        self.db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for table in SEARCH_TABLES:
+            self.db.session.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_{0}_search_vector ON {0} USING gin ({1})'.format(table, self.VECTOR)
+            ))
+            self.db.session.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_{0}_name_trgm ON {0} USING gin (lower(name) gin_trgm_ops)'.format(table)
+            ))
+        self.db.session.commit()
+
+    def search(self, table, term, limit):
+        tokens = tokenize(term)
+        if not tokens:
+            return self.browse(table, limit)
+        # every word must match, the last ones as a prefix (typeahead friendly)
+        query = ' & '.join(token + ':*' for token in tokens)
+        pattern = contains_pattern(term)
+        sql = (
+            'SELECT id, name FROM {table} '
+            "WHERE {vector} @@ to_tsquery('simple'::regconfig, :query) "
+            'OR lower(name) LIKE :pattern '
+            "ORDER BY ts_rank({vector}, to_tsquery('simple'::regconfig, :query)) "
+            '+ similarity(lower(name), :term) DESC, name, id '
+            'LIMIT :limit'
+        ).format(table=table, vector=self.VECTOR)
+        return self.db.session.execute(
+            text(sql),
+            {'query': query, 'pattern': pattern, 'term': term.strip().lower(), 'limit': limit}
+        ).fetchall()
+
+
+class SqliteSearchBackend(SearchBackend):
+    # FTS5 external-content tables kept in sync by triggers, so the same
+    # search API can be exercised and benchmarked locally without Postgres.
+    # Like the Postgres backend, a substring of the name also matches (found
+    # by a scan, SQLite has no trigram index). Until `flask search-index`
+    # has created a table's FTS index, that table is searched with LIKE.
+    name = 'sqlite'
+
+    def __init__(self, db):
+        super(SqliteSearchBackend, self).__init__(db)
+        self.indexed = set()
+
+    def has_index(self, table):
+        # whether table's FTS table exists; looked up until it does
+        if table not in self.indexed and self.db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table + '_fts'}
+        ).first():
+            self.indexed.add(table)
+        return table in self.indexed
+
+    def install(self):
+        columns = ', '.join(SEARCH_COLUMNS)
+        new_values = ', '.join('new.' + column for column in SEARCH_COLUMNS)
+        old_values = ', '.join('old.' + column for column in SEARCH_COLUMNS)
+        for table in SEARCH_TABLES:
+            statements = [
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {0}_fts USING fts5({1}, content='{0}', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')",
+                'CREATE TRIGGER IF NOT EXISTS {0}_fts_insert AFTER INSERT ON {0} BEGIN '
+                'INSERT INTO {0}_fts(rowid, {1}) VALUES (new.id, {2}); END',
+                'CREATE TRIGGER IF NOT EXISTS {0}_fts_delete AFTER DELETE ON {0} BEGIN '
+                "INSERT INTO {0}_fts({0}_fts, rowid, {1}) VALUES ('delete', old.id, {3}); END",
+                'CREATE TRIGGER IF NOT EXISTS {0}_fts_update AFTER UPDATE ON {0} BEGIN '
+                "INSERT INTO {0}_fts({0}_fts, rowid, {1}) VALUES ('delete', old.id, {3}); "
+                'INSERT INTO {0}_fts(rowid, {1}) VALUES (new.id, {2}); END',
+                "INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild')",
+            ]
+            for statement in statements:
+                self.db.session.execute(text(statement.format(table, columns, new_values, old_values)))
+        self.db.session.commit()
+
+    def search(self, table, term, limit):
+        tokens = tokenize(term)
+        if not tokens:
+            return self.browse(table, limit)
+        if not self.has_index(table):
+            return LikeSearchBackend(self.db).search(table, term, limit)
+        # every word must match as a prefix, name matches weighing the most;
+        # name substrings come after them (bm25 scores are negative)
+        query = ' '.join('"{}"*'.format(token) for token in tokens)
+        sql = (
+            'SELECT id, name FROM ('
+            'SELECT {0}.id, {0}.name, bm25({0}_fts, 10.0, 2.0, 2.0, 1.0) AS rank '
+            'FROM {0}_fts JOIN {0} ON {0}.id = {0}_fts.rowid WHERE {0}_fts MATCH :query '
+            'UNION ALL '
+            "SELECT id, name, 0 FROM {0} WHERE lower(name) LIKE :pattern ESCAPE '\\'"
+            ') GROUP BY id, name ORDER BY min(rank), name, id '
+            'LIMIT :limit'
+        ).format(table)
+        return self.db.session.execute(
+            text(sql), {'query': query, 'pattern': contains_pattern(term), 'limit': limit}
+        ).fetchall()
+
+
+BACKENDS = {
+    'like': LikeSearchBackend,
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_backend(db, name='auto'):
+    # 'auto' picks the indexed backend for the database the app is bound to
+    if name == 'auto':
+        name = db.engine.dialect.name
+    return BACKENDS.get(name, LikeSearchBackend)(db)
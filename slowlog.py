@@ -0,0 +1,174 @@
+# Imports
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+
+import click
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Slow-query log.
+#
+# Statements that take longer than SLOW_QUERY_MS are written to
+# SLOW_QUERY_LOG as JSON Lines: the statement and its parameters, the route
+# and view function (or CLI command) that ran it, and its EXPLAIN plan, taken
+# right away on the same connection. `flask slow-queries` ranks the logged
+# statements by total time.
+#----------------------------------------------------------------------------#
+
+log = logging.getLogger('fyyur.slow_queries')
+log.setLevel(logging.INFO)
+log.propagate = False
+
+# statements EXPLAIN can describe without running them
+EXPLAINABLE = ('select', 'with', 'update', 'delete')
+
+# longest parameter value kept in an entry
+MAX_PARAM_LENGTH = 200
+
+
+def log_to(path):
+    # write the slow-query log to path (once per process)
+    if not log.handlers:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = logging.FileHandler(path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        log.addHandler(handler)
+
+
+def threshold():
+    # SLOW_QUERY_MS as seconds, or None when the log is off or outside the app
+    if not has_app_context() or not log.handlers:
+        return None
+    ms = current_app.config.get('SLOW_QUERY_MS')
+    return ms / 1000.0 if ms else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('slow_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['slow_query_started'].pop()
+    limit = threshold()
+    if limit is None or seconds < limit:
+        return
+    entry = {
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'ms': round(seconds * 1000, 2),
+        'statement': statement,
+        'parameters': clip(parameters),
+        'executemany': executemany,
+    }
+    entry.update(origin())
+    if not executemany and current_app.config.get('SLOW_QUERY_EXPLAIN'):
+        entry['plan'] = explain(conn, cursor, statement, parameters)
+    log.info(json.dumps(entry, default=str))
+
+
+def clip(parameters):
+    # parameters as JSON-able values, long strings cut short
+    if isinstance(parameters, dict):
+        return {key: clip(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [clip(value) for value in parameters]
+    if isinstance(parameters, (bytes, str)) and len(parameters) > MAX_PARAM_LENGTH:
+        return parameters[:MAX_PARAM_LENGTH] + '...' if isinstance(parameters, str) else '<{} bytes>'.format(len(parameters))
+    return parameters
+
+
+def origin():
+    # the route and view function, or the CLI command, that ran the statement
+    if has_request_context():
+        view = current_app.view_functions.get(request.endpoint)
+        return {
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else request.path,
+            'view': view.__name__ if view else None,
+        }
+    command = click.get_current_context(silent=True)
+    return {'command': command.command_path if command else None}
+
+
+def explain(conn, cursor, statement, parameters):
+    # the statement's plan, through a fresh DBAPI cursor so the EXPLAIN itself
+    # fires no engine events; a failed EXPLAIN must not break the transaction
+    if not statement.lstrip().lower().startswith(EXPLAINABLE):
+        return None
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect == 'postgresql':
+        prefix = 'EXPLAIN '
+    else:
+        return None
+    explainCursor = cursor.connection.cursor()
+    try:
+        if dialect == 'postgresql':
+            explainCursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            explainCursor.execute(prefix + statement, parameters)
+            rows = explainCursor.fetchall()
+        except Exception as error:
+            if dialect == 'postgresql':
+                explainCursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return 'EXPLAIN failed: {}'.format(error)
+        if dialect == 'postgresql':
+            explainCursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return '\n'.join(row[0] for row in rows)
+        # SQLite: (id, parent, notused, detail)
+        return '\n'.join(row[-1] for row in rows)
+    finally:
+        explainCursor.close()
+
+#----------------------------------------------------------------------------#
+# Report.
+#----------------------------------------------------------------------------#
+
+def fingerprint(statement):
+    # one key per query shape: whitespace collapsed, IN lists and literals folded
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    statement = re.sub(r"'(?:[^']|'')*'", "'?'", statement)
+    statement = re.sub(r'\b\d+\b', '0', statement)
+    placeholder = r'\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*'
+    return re.sub(r'IN \((?:{0},)*{0}\)'.format(placeholder), 'IN (...)', statement, flags=re.IGNORECASE)
+
+
+def top_offenders(lines, sort='total'):
+    # aggregate slow-query log lines per statement shape, worst first
+    offenders = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        key = fingerprint(entry['statement'])
+        offender = offenders.get(key)
+        if offender is None:
+            offender = offenders[key] = {
+                'statement': key, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'sources': {}, 'plan': None,
+            }
+        offender['count'] += 1
+        offender['total_ms'] += entry['ms']
+        if entry['ms'] >= offender['max_ms']:
+            # keep the plan and parameters of the slowest run
+            offender['max_ms'] = entry['ms']
+            offender['plan'] = entry.get('plan')
+            offender['parameters'] = entry.get('parameters')
+        source = entry.get('view') or entry.get('command') or '?'
+        offender['sources'][source] = offender['sources'].get(source, 0) + 1
+    for offender in offenders.values():
+        offender['total_ms'] = round(offender['total_ms'], 2)
+        offender['mean_ms'] = round(offender['total_ms'] / offender['count'], 2)
+    key = {'total': 'total_ms', 'count': 'count', 'max': 'max_ms', 'mean': 'mean_ms'}[sort]
+    return sorted(offenders.values(), key=lambda offender: offender[key], reverse=True)
@@ -0,0 +1,107 @@
+# Imports
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+#----------------------------------------------------------------------------#
+# Autocomplete prefix index.
+#
+# An in-process sorted array of normalized name keys, searched with bisect,
+# so typeahead suggestions never touch the database. Every word of a name
+# starts its own key, so "hop" suggests "The Musical Hop" as well.
+#----------------------------------------------------------------------------#
+
+
+def normalize(name):
+    # lowercase, strip accents and collapse whitespace
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return ' '.join(name.lower().split())
+
+
+def name_keys(name):
+    # "the musical hop" -> "the musical hop", "musical hop", "hop"
+    words = normalize(name).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex(object):
+
+    def __init__(self):
+        self._keys = []     # sorted (key, kind, id) tuples
+        self._names = {}    # (kind, id) -> display name
+        self._lock = threading.Lock()
+        self._pending = None    # writes to replay onto the next load()
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._names)
+
+    def start_reload(self):
+        # call before reading the rows for load(): writes from then on are
+        # replayed onto the new index, so one that lands meanwhile isn't lost
+        with self._lock:
+            self._pending = []
+
+    def load(self, rows):
+        # rebuild from (kind, id, name) rows in one go
+        keys = []
+        names = {}
+        for kind, id, name in rows:
+            names[(kind, id)] = name
+            keys.extend((key, kind, id) for key in name_keys(name))
+        keys.sort()
+        with self._lock:
+            self._keys = keys
+            self._names = names
+            for write, args in self._pending or ():
+                write(*args)
+            self._pending = None
+            self.loaded_at = time.monotonic()
+
+    def add(self, kind, id, name):
+        with self._lock:
+            self._add(kind, id, name)
+            if self._pending is not None:
+                self._pending.append((self._add, (kind, id, name)))
+
+    def remove(self, kind, id):
+        with self._lock:
+            self._remove(kind, id)
+            if self._pending is not None:
+                self._pending.append((self._remove, (kind, id)))
+
+    def _add(self, kind, id, name):
+        self._remove(kind, id)
+        self._names[(kind, id)] = name
+        for key in name_keys(name):
+            insort(self._keys, (key, kind, id))
+
+    def _remove(self, kind, id):
+        name = self._names.pop((kind, id), None)
+        if name is None:
+            return
+        for key in name_keys(name):
+            i = bisect_left(self._keys, (key, kind, id))
+            if i < len(self._keys) and self._keys[i] == (key, kind, id):
+                del self._keys[i]
+
+    def suggest(self, prefix, limit=10, kind=None):
+        # names with a word starting with prefix, ordered by the matching key
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                key, entryKind, id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if (kind is None or entryKind == kind) and (entryKind, id) not in seen:
+                    seen.add((entryKind, id))
+                    results.append({'type': entryKind, 'id': id, 'name': self._names[(entryKind, id)]})
+                i += 1
+        return results